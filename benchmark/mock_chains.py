@@ -0,0 +1,489 @@
+"""Local stand-ins for the chain endpoints polled by the exporter
+
+Every server answers with fixed balances after an injected latency, and
+fails a share of the requests. Requests are counted per chain and method,
+the counts being served as json by the control server.
+"""
+
+import asyncio
+import base64
+import json
+import random
+import struct
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import websockets
+from eth_abi import decode, encode
+from scalecodec.base import RuntimeConfigurationObject
+from scalecodec.type_registry import load_type_registry_preset
+
+from multicall import MULTICALL3_ADDRESS
+
+# ports of the servers, from the base port
+CONTROL, COSMOS, EVM, BERA, SOLANA, SUBSTRATE = range(6)
+
+EVM_CHAIN_ID = 1
+BERA_CHAIN_ID = 80094
+BLOCK_HASH = "0x" + "11" * 32
+HEAD_HEIGHT = 1000
+# the token accounts are all served under the legacy Token program
+TOKEN_PROGRAM = "TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA"
+
+
+class Faults:
+    """Latency and errors injected in every request"""
+
+    def __init__(self, latency=0.05, jitter=0.02, error_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+    def delay(self):
+        return max(0, random.gauss(self.latency, self.jitter))
+
+    def fail(self):
+        return random.random() < self.error_rate
+
+
+class Stats:
+    """Requests and calls received, per chain"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = Counter()
+        self.calls = Counter()
+
+    def record(self, chain, methods):
+        with self._lock:
+            self.requests[chain] += 1
+            for method in methods:
+                self.calls[f"{chain}.{method}"] += 1
+
+    def snapshot(self, reset=False):
+        with self._lock:
+            snapshot = {"requests": dict(self.requests), "calls": dict(self.calls)}
+            if reset:
+                self.requests.clear()
+                self.calls.clear()
+        return snapshot
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    # keep-alive, the exporter pools its connections
+    protocol_version = "HTTP/1.1"
+    # headers and body are separate writes, avoid the delayed ack stalls
+    disable_nagle_algorithm = True
+    chain = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _inject(self, methods):
+        """Record a request and apply the faults, False if it must fail"""
+        self.server.stats.record(self.chain, methods)
+        time.sleep(self.server.faults.delay())
+        if self.server.faults.fail():
+            self._send_json({"error": "injected failure"}, status=503)
+            return False
+        return True
+
+
+class ControlHandler(MockHandler):
+    """GET /stats, with ?reset=1 to start counting again"""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        reset = parse_qs(url.query).get("reset", ["0"])[0] == "1"
+        self._send_json(self.server.stats.snapshot(reset))
+
+
+def _rest_method(path):
+    """Name a cosmos REST query by the segment after its version"""
+    parts = path.strip("/").split("/")
+    versions = [i for i, part in enumerate(parts) if part in ("v1", "v1beta1")]
+    if not versions or versions[0] + 1 >= len(parts):
+        return parts[-1]
+    method = parts[versions[0] + 1]
+    # delegators/{address}/rewards and the like
+    return parts[-1] if method == "delegators" else method
+
+
+class CosmosHandler(MockHandler):
+    """Cosmos REST api and rpc /status, paginating the staking queries"""
+
+    chain = "cosmos"
+    page_size = 2
+    delegations = 5
+
+    def _page(self, query, key, entries):
+        offset = 0
+        if "pagination.key" in query:
+            offset = int(base64.b64decode(query["pagination.key"][0]))
+        end = offset + self.page_size
+        next_key = base64.b64encode(str(end).encode()).decode()
+        return {
+            key: entries[offset:end],
+            "pagination": {"next_key": next_key if end < len(entries) else None},
+        }
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        path, query = url.path, parse_qs(url.query)
+        if not self._inject([_rest_method(path)]):
+            return
+        if path == "/status":
+            data = {"result": {"sync_info": {"latest_block_height": str(HEAD_HEIGHT)}}}
+        elif path.startswith("/cosmos/bank/v1beta1/balances/"):
+            data = {
+                "balances": [
+                    {"denom": "uatom", "amount": "1000000"},
+                    {"denom": "ibc/27394FB092D2ECCD56123C74F36E4C1F", "amount": "5"},
+                ],
+                "pagination": {"next_key": None},
+            }
+        elif path.startswith("/ibc/apps/transfer/v1/denom_traces/"):
+            data = {
+                "denom_trace": {"path": "transfer/channel-0", "base_denom": "uosmo"}
+            }
+        elif path.startswith("/cosmos/staking/v1beta1/delegations/"):
+            entry = {"balance": {"denom": "uatom", "amount": "2000000"}}
+            data = self._page(query, "delegation_responses", [entry] * self.delegations)
+        elif path.endswith("/unbonding_delegations"):
+            entry = {"entries": [{"balance": "1000"}]}
+            data = self._page(query, "unbonding_responses", [entry] * 3)
+        elif path.endswith("/rewards"):
+            data = {"total": [{"denom": "uatom", "amount": "3000000.5"}]}
+        else:
+            self._send_json({"code": 5, "message": "not found"}, status=404)
+            return
+        self._send_json(data)
+
+
+def _eth_call(to, data):
+    """Answer a contract read, Multicall3 aggregate3 being run recursively"""
+    selector = data[:4].hex()
+    if to.lower() == MULTICALL3_ADDRESS.lower():
+        (calls,) = decode(["(address,bool,bytes)[]"], data[4:])
+        results = [(True, _eth_call(target, call)) for target, _, call in calls]
+        return encode(["(bool,bytes)[]"], [results])
+    if selector == "313ce567":  # decimals()
+        return encode(["uint8"], [6])
+    if selector == "95d89b41":  # symbol()
+        return encode(["string"], ["USDC"])
+    # balanceOf and the BGT reads all fit an uint256
+    return encode(["uint256"], [5 * 10**18])
+
+
+class JsonRpcHandler(MockHandler, ABC):
+    """JSON-RPC over http, single and batched requests"""
+
+    @abstractmethod
+    def result(self, method, params):
+        """Return the result of a call, raising KeyError for an unknown method"""
+
+    def _answer(self, request):
+        try:
+            result = self.result(request["method"], request.get("params", []))
+        except KeyError:
+            return {
+                "jsonrpc": "2.0",
+                "id": request.get("id"),
+                "error": {"code": -32601, "message": "Method not found"},
+            }
+        return {"jsonrpc": "2.0", "id": request.get("id"), "result": result}
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        requests = body if isinstance(body, list) else [body]
+        if not self._inject([request["method"] for request in requests]):
+            return
+        answers = [self._answer(request) for request in requests]
+        self._send_json(answers if isinstance(body, list) else answers[0])
+
+
+class EvmHandler(JsonRpcHandler):
+    chain = "evm"
+    chain_id = EVM_CHAIN_ID
+
+    def result(self, method, params):
+        if method == "eth_chainId":
+            return hex(self.chain_id)
+        if method == "eth_blockNumber":
+            return hex(HEAD_HEIGHT)
+        if method == "eth_getBalance":
+            return hex(2 * 10**18)
+        if method == "eth_call":
+            call = params[0]
+            data = call.get("data") or call.get("input")
+            return "0x" + _eth_call(call["to"], bytes.fromhex(data[2:])).hex()
+        raise KeyError(method)
+
+
+class BeraHandler(EvmHandler):
+    chain = "bera"
+    chain_id = BERA_CHAIN_ID
+
+
+class SolanaHandler(JsonRpcHandler):
+    chain = "solana"
+
+    @staticmethod
+    def _token_account(owner, mint, amount, decimals):
+        info = {
+            "mint": mint,
+            "owner": owner,
+            "tokenAmount": {
+                "amount": str(amount),
+                "decimals": decimals,
+                "uiAmount": amount / 10**decimals,
+                "uiAmountString": str(amount / 10**decimals),
+            },
+        }
+        return {
+            "pubkey": owner,
+            "account": {
+                "lamports": 2039280,
+                "owner": TOKEN_PROGRAM,
+                "executable": False,
+                "rentEpoch": 0,
+                "space": 165,
+                "data": {
+                    "program": "spl-token",
+                    "space": 165,
+                    "parsed": {"type": "account", "info": info},
+                },
+            },
+        }
+
+    def result(self, method, params):
+        context = {"slot": HEAD_HEIGHT}
+        if method == "getSlot":
+            return HEAD_HEIGHT
+        if method == "getBalance":
+            return {"context": context, "value": 3 * 10**9}
+        if method == "getMultipleAccounts":
+            account = {
+                "lamports": 3 * 10**9,
+                "data": ["", "base64"],
+                "owner": "11111111111111111111111111111111",
+                "executable": False,
+                "rentEpoch": 0,
+                "space": 0,
+            }
+            return {"context": context, "value": [account] * len(params[0])}
+        if method == "getTokenAccountsByOwner":
+            if params[1].get("programId") != TOKEN_PROGRAM:
+                return {"context": context, "value": []}
+            usdc = "EPjFWdd5AufqSSqeM2qN1xzybapC8G4wEGGkZwyTDt1v"
+            return {
+                "context": context,
+                "value": [self._token_account(params[0], usdc, 1500000, 6)],
+            }
+        raise KeyError(method)
+
+
+def substrate_metadata():
+    """Encode a V14 metadata with only the System.Account storage
+
+    This is all substrate-interface needs to read balances, so the stand-in
+    node does not depend on the metadata of a real chain.
+    """
+
+    def registry_type(type_id, definition, path=()):
+        return {
+            "id": type_id,
+            "type": {"path": list(path), "params": [], "def": definition, "docs": []},
+        }
+
+    def field(name, type_id, type_name):
+        return {"name": name, "type": type_id, "typeName": type_name, "docs": []}
+
+    types = [
+        registry_type(0, {"primitive": "u8"}),
+        registry_type(1, {"array": {"len": 32, "type": 0}}),
+        registry_type(
+            2,
+            {"composite": {"fields": [field(None, 1, "[u8; 32]")]}},
+            ["sp_core", "crypto", "AccountId32"],
+        ),
+        registry_type(3, {"primitive": "u32"}),
+        registry_type(4, {"primitive": "u128"}),
+        registry_type(
+            5,
+            {
+                "composite": {
+                    "fields": [
+                        field(name, 4, "Balance")
+                        for name in ("free", "reserved", "frozen", "flags")
+                    ]
+                }
+            },
+            ["pallet_balances", "types", "AccountData"],
+        ),
+        registry_type(
+            6,
+            {
+                "composite": {
+                    "fields": [
+                        field(name, 3, "u32")
+                        for name in ("nonce", "consumers", "providers", "sufficients")
+                    ]
+                    + [field("data", 5, "AccountData")]
+                }
+            },
+            ["frame_system", "AccountInfo"],
+        ),
+        registry_type(7, {"tuple": []}),
+    ]
+    account = {
+        "name": "Account",
+        "modifier": "Default",
+        "type": {"Map": {"hashers": ["Blake2_128Concat"], "key": 2, "value": 6}},
+        "default": "0x" + "00" * 80,
+        "documentation": [],
+    }
+    system = {
+        "name": "System",
+        "storage": {"prefix": "System", "entries": [account]},
+        "calls": None,
+        "event": None,
+        "constants": [],
+        "error": None,
+        "index": 0,
+    }
+    metadata = {
+        "types": {"types": types},
+        "pallets": [system],
+        "extrinsic": {"ty": 7, "version": 4, "signed_extensions": []},
+        "runtime_type": 7,
+    }
+    runtime_config = RuntimeConfigurationObject()
+    runtime_config.update_type_registry(load_type_registry_preset("core"))
+    versioned = runtime_config.create_scale_object("MetadataVersioned")
+    return versioned.encode(["0x6d657461", {"V14": metadata}]).to_hex()
+
+
+def _account_info(free):
+    # nonce, consumers, providers, sufficients then free, reserved, frozen, flags
+    return (
+        "0x"
+        + (
+            struct.pack("<4I", 1, 0, 1, 0) + free.to_bytes(16, "little") + bytes(48)
+        ).hex()
+    )
+
+
+class SubstrateNode:
+    """Substrate websocket JSON-RPC, enough for substrate-interface"""
+
+    chain = "substrate"
+
+    def __init__(self, stats, faults):
+        self.stats = stats
+        self.faults = faults
+        self.metadata = substrate_metadata()
+        self.responses = {
+            "chain_getHead": BLOCK_HASH,
+            "chain_getBlockHash": BLOCK_HASH,
+            "chain_getFinalizedHead": BLOCK_HASH,
+            "chain_getHeader": {
+                "parentHash": BLOCK_HASH,
+                "number": hex(HEAD_HEIGHT),
+                "stateRoot": BLOCK_HASH,
+                "extrinsicsRoot": BLOCK_HASH,
+                "digest": {"logs": []},
+            },
+            "state_getRuntimeVersion": {
+                "specName": "mock",
+                "implName": "mock",
+                "authoringVersion": 1,
+                "specVersion": 1,
+                "implVersion": 1,
+                "apis": [],
+                "transactionVersion": 1,
+                "stateVersion": 1,
+            },
+            "state_getMetadata": self.metadata,
+            "system_properties": {
+                "ss58Format": 0,
+                "tokenDecimals": 10,
+                "tokenSymbol": "DOT",
+            },
+            "system_chain": "Mock",
+            "system_name": "mock",
+            "system_version": "1.0.0",
+        }
+        methods = sorted(self.responses) + ["rpc_methods", "state_queryStorageAt"]
+        self.responses["rpc_methods"] = {"methods": methods}
+
+    def result(self, method, params):
+        if method == "state_queryStorageAt":
+            changes = [[key, _account_info(12345 * 10**10)] for key in params[0]]
+            return [{"block": BLOCK_HASH, "changes": changes}]
+        return self.responses[method]
+
+    async def _serve(self, ws):
+        try:
+            await self._answer(ws)
+        except websockets.ConnectionClosed:
+            pass
+
+    async def _answer(self, ws):
+        async for message in ws:
+            request = json.loads(message)
+            self.stats.record(self.chain, [request["method"]])
+            await asyncio.sleep(self.faults.delay())
+            answer = {"jsonrpc": "2.0", "id": request["id"]}
+            if self.faults.fail():
+                answer["error"] = {"code": -32000, "message": "injected failure"}
+            else:
+                try:
+                    answer["result"] = self.result(
+                        request["method"], request.get("params")
+                    )
+                except KeyError:
+                    answer["error"] = {"code": -32601, "message": "Method not found"}
+            await ws.send(json.dumps(answer))
+
+    async def run(self, port):
+        # nodes do not ping, an idle client would not answer
+        async with websockets.serve(
+            self._serve, "127.0.0.1", port, max_size=None, ping_interval=None
+        ):
+            await asyncio.Future()
+
+
+def serve(base_port, faults):
+    """Run every stand-in server until the process ends
+
+    Ports, from base_port: control, cosmos, evm, bera, solana, substrate.
+    """
+    stats = Stats()
+    handlers = {
+        CONTROL: ControlHandler,
+        COSMOS: CosmosHandler,
+        EVM: EvmHandler,
+        BERA: BeraHandler,
+        SOLANA: SolanaHandler,
+    }
+    for offset, handler in handlers.items():
+        server = ThreadingHTTPServer(("127.0.0.1", base_port + offset), handler)
+        server.daemon_threads = True
+        server.stats = stats
+        server.faults = faults
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    node = SubstrateNode(stats, faults)
+    asyncio.run(node.run(base_port + SUBSTRATE))
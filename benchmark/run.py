@@ -0,0 +1,287 @@
+"""Measure the fetch cycles of the exporter against local stand-in chains
+
+Run from the repository root:
+
+    python -m benchmark.run --wallets 10,100,1000 --latency 0.05
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import resource
+import tempfile
+import time
+import urllib.request
+
+from scalecodec.utils.ss58 import ss58_encode
+from solders.pubkey import Pubkey
+
+from benchmark.mock_chains import (
+    BERA,
+    BERA_CHAIN_ID,
+    COSMOS,
+    CONTROL,
+    EVM,
+    EVM_CHAIN_ID,
+    SOLANA,
+    SUBSTRATE,
+    Faults,
+    serve,
+)
+from cosmos import COSMOS_REGISTRY_URLS
+from ethereum import EVM_CHAINS_URL
+
+CHAINS = ("cosmos", "evm", "bera", "solana", "substrate")
+ERC20_ADDRESS = "0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48"
+BGT_ADDRESS = "0x656b95E550C07a9ffe548bd4085c72418Ceb1dba"
+
+
+def _address(chain, i):
+    """Return a valid and distinct address for the i-th wallet of a chain"""
+    seed = (i + 1).to_bytes(32, "big")
+    if chain == "cosmos":
+        return f"cosmos1bench{i:038d}"
+    if chain in ("evm", "bera"):
+        return "0x" + seed[-20:].hex()
+    if chain == "solana":
+        return str(Pubkey(seed))
+    return ss58_encode(seed, 0)
+
+
+def generate_config(wallet_count, chains, base_port, token_share=0.25):
+    """Return a wallet config spreading wallet_count wallets over some chains
+
+    Args:
+      token_share: share of the evm wallets also holding an ERC-20
+    """
+    http = "http://127.0.0.1:{}"
+    endpoints = {
+        "cosmos": (http.format(base_port + COSMOS),) * 2,
+        "evm": (http.format(base_port + EVM),) * 2,
+        "bera": (http.format(base_port + BERA),) * 2,
+        "solana": (http.format(base_port + SOLANA),) * 2,
+        "substrate": (f"ws://127.0.0.1:{base_port + SUBSTRATE}",) * 2,
+    }
+    networks = []
+    for index, chain in enumerate(chains):
+        count = wallet_count // len(chains) + (index < wallet_count % len(chains))
+        rpc, api = endpoints[chain]
+        network = {
+            "name": "cosmoshub" if chain == "cosmos" else f"bench-{chain}",
+            "type": chain,
+            "rpc": rpc,
+            "api": api,
+            "wallets": [],
+        }
+        if chain == "bera":
+            network["bgt_address"] = BGT_ADDRESS
+        for i in range(count):
+            wallet = {"name": f"{chain}-{i}", "address": _address(chain, i)}
+            network["wallets"].append(wallet)
+            if chain == "evm" and i < count * token_share:
+                network["wallets"].append(
+                    dict(
+                        wallet, name=f"{chain}-{i}-usdc", contract_address=ERC20_ADDRESS
+                    )
+                )
+        networks.append(network)
+    return {"networks": networks}
+
+
+def seed_registry_cache(cache_dir):
+    """Write the chain registries to the cache so nothing is downloaded"""
+    chain = {"denom": "uatom", "decimals": 6, "symbol": "ATOM"}
+    registries = {
+        "cosmos_mainnet": (
+            COSMOS_REGISTRY_URLS["mainnet"],
+            {"chains": [dict(chain, name="cosmoshub")]},
+        ),
+        "cosmos_testnet": (COSMOS_REGISTRY_URLS["testnet"], {"chains": []}),
+        "evm_chains": (
+            EVM_CHAINS_URL,
+            [
+                {
+                    "chainId": EVM_CHAIN_ID,
+                    "name": "Ethereum",
+                    "nativeCurrency": {"symbol": "ETH", "decimals": 18},
+                },
+                {
+                    "chainId": BERA_CHAIN_ID,
+                    "name": "Berachain",
+                    "nativeCurrency": {"symbol": "BERA", "decimals": 18},
+                },
+            ],
+        ),
+    }
+    for name, (url, data) in registries.items():
+        with open(os.path.join(cache_dir, f"{name}.json"), "w") as f:
+            json.dump(data, f)
+        meta = {"url": url, "etag": None, "last_modified": None}
+        with open(os.path.join(cache_dir, f"{name}.meta.json"), "w") as f:
+            json.dump(dict(meta, fetched_at=time.time()), f)
+
+
+def mock_stats(base_port, reset=False):
+    url = f"http://127.0.0.1:{base_port + CONTROL}/stats?reset={int(reset)}"
+    with urllib.request.urlopen(url) as r:
+        return json.load(r)
+
+
+def _cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_exporter(wallet_count, args, results):
+    """Run the fetch cycles of one config, in a process of its own"""
+    # imported here so the exporter is only loaded in the measured process
+    from exporter import AppMetrics
+    from utils import configure_logging
+
+    walletconfig = generate_config(
+        wallet_count, args.chains, args.base_port, args.token_share
+    )
+    with tempfile.TemporaryDirectory() as cache_dir:
+        seed_registry_cache(cache_dir)
+        app = AppMetrics(
+            walletconfig=walletconfig,
+            logging=configure_logging("text", args.log_level),
+            fetch_workers=args.fetch_workers,
+            max_in_flight_per_host=args.max_in_flight_per_host,
+            cosmos_async_http=args.cosmos_async_http,
+            registry_cache_dir=cache_dir,
+            fetch_deadline_seconds=args.deadline,
+        )
+        cycles = []
+        for _ in range(args.cycles):
+            mock_stats(args.base_port, reset=True)
+            cpu_start, start = _cpu_time(), time.perf_counter()
+            app.fetch()
+            cycles.append(
+                {
+                    "seconds": time.perf_counter() - start,
+                    "cpu_seconds": _cpu_time() - cpu_start,
+                    **mock_stats(args.base_port),
+                }
+            )
+        if app.async_http is not None:
+            app.async_http.close()
+    results.put(
+        {
+            "wallets": wallet_count,
+            "cycles": cycles,
+            # kilobytes on linux
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        }
+    )
+
+
+def _summary(result):
+    first, warm = result["cycles"][0], result["cycles"][1:] or result["cycles"]
+    return {
+        "wallets": result["wallets"],
+        "first_cycle_s": first["seconds"],
+        "cycle_s": sum(c["seconds"] for c in warm) / len(warm),
+        "cpu_s": sum(c["cpu_seconds"] for c in warm) / len(warm),
+        "requests": sum(sum(c["requests"].values()) for c in warm) / len(warm),
+        "rpc_calls": sum(sum(c["calls"].values()) for c in warm) / len(warm),
+        "peak_rss_mb": result["peak_rss_mb"],
+    }
+
+
+def argsparse():
+    parser = argparse.ArgumentParser(description="Wallets Exporter benchmark")
+    parser.add_argument(
+        "--wallets",
+        default="10,100,1000,10000",
+        help="comma separated wallet counts, one run each",
+    )
+    parser.add_argument(
+        "--chains",
+        default=",".join(CHAINS),
+        help="comma separated network types the wallets are spread over",
+    )
+    parser.add_argument("--cycles", type=int, default=3, help="fetch cycles per run")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds")
+    parser.add_argument("--jitter", type=float, default=0.01, help="seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--token-share", type=float, default=0.25)
+    parser.add_argument("--fetch-workers", type=int, default=16)
+    parser.add_argument("--max-in-flight-per-host", type=int, default=4)
+    parser.add_argument(
+        "--cosmos-async-http", type=lambda v: v.lower() == "true", default=True
+    )
+    parser.add_argument("--deadline", type=float, default=600, help="seconds")
+    parser.add_argument("--base-port", type=int, default=19000)
+    parser.add_argument("--log-level", default="CRITICAL")
+    parser.add_argument("--json", help="file where the raw results are written")
+    args = parser.parse_args()
+    args.wallets = [int(count) for count in args.wallets.split(",")]
+    args.chains = args.chains.split(",")
+    unknown = set(args.chains) - set(CHAINS)
+    if unknown:
+        parser.error(f"unknown chains {', '.join(sorted(unknown))}")
+    return args
+
+
+def main():
+    args = argsparse()
+    # fresh processes, so the peak rss of a run is its own
+    context = multiprocessing.get_context("spawn")
+    faults = Faults(args.latency, args.jitter, args.error_rate)
+    mocks = context.Process(target=serve, args=(args.base_port, faults), daemon=True)
+    mocks.start()
+    for _ in range(100):
+        try:
+            mock_stats(args.base_port)
+            break
+        except OSError:
+            time.sleep(0.1)
+
+    columns = (
+        "wallets",
+        "first_cycle_s",
+        "cycle_s",
+        "cpu_s",
+        "requests",
+        "rpc_calls",
+        "peak_rss_mb",
+    )
+    print(" ".join(f"{column:>13}" for column in columns), flush=True)
+    raw = []
+    for wallet_count in args.wallets:
+        results = context.Queue()
+        run = context.Process(target=run_exporter, args=(wallet_count, args, results))
+        run.start()
+        while True:
+            try:
+                result = results.get(timeout=1)
+                break
+            except queue.Empty:
+                if not run.is_alive():
+                    raise SystemExit(f"The run of {wallet_count} wallets failed")
+        run.join()
+        raw.append(result)
+        summary = _summary(result)
+        print(
+            " ".join(
+                (
+                    f"{summary[column]:>13.2f}"
+                    if isinstance(summary[column], float)
+                    else f"{summary[column]:>13}"
+                )
+                for column in columns
+            ),
+            flush=True,
+        )
+    mocks.terminate()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(raw, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,79 @@
 import json
+from functools import lru_cache
 
+from ethereum import get_web3
 from web3 import Web3
 
+# BGT view functions exported per wallet, with their signature and output type
+BGT_READS = {
+    "boosts": ("boosts(address)", "uint128"),
+    "boostees": ("boostees(bytes)", "uint128"),
+    "unboostedBalanceOf": ("unboostedBalanceOf(address)", "uint256"),
+    "queuedBoost": ("queuedBoost(address)", "uint128"),
+}
 
-def create_contract(address, abi, api):
-    w3 = Web3(Web3.HTTPProvider(api))
-    contract_address = Web3.to_checksum_address(address)
+
+def add_bgt_reads(multicall, bgt_address, wallet):
+    """Queue the BGT reads of a wallet on a Multicall
+
+    Returns:
+      A dict of BGT function name to the index of its read
+    """
+    indexes = {}
+    for name, (signature, output_type) in BGT_READS.items():
+        # boostees takes a pubkey, the wallet is passed as bytes like web3 does
+        arg = Web3.to_bytes(hexstr=wallet) if name == "boostees" else wallet
+        indexes[name] = multicall.add(bgt_address, signature, [arg], output_type)
+    return indexes
+
+
+BGT_ABI = "./abi/BGT.json"
+
+
+@lru_cache(maxsize=None)
+def load_abi(abi):
+    """Parse an abi file once per process"""
     with open(abi) as abi_file:
-        abi_file = json.load(abi_file)
+        return json.load(abi_file)
+
 
-    return w3.eth.contract(address=contract_address, abi=abi_file)
+@lru_cache(maxsize=None)
+def create_contract(address, abi, api):
+    """Return the contract object of an address, built once per (address, abi, api)"""
+    w3 = get_web3(api)
+    contract_address = Web3.to_checksum_address(address)
+    return w3.eth.contract(address=contract_address, abi=load_abi(abi))
 
 
 def get_bera_boosts(bgt_address, wallet, api):
-    bgt = create_contract(bgt_address, "./abi/BGT.json", api)
+    bgt = create_contract(bgt_address, BGT_ABI, api)
     result = bgt.functions.boosts(wallet).call()
     return result
 
 
 def get_bera_boostees(bgt_address, wallet, api):
-    bgt = create_contract(bgt_address, "./abi/BGT.json", api)
+    bgt = create_contract(bgt_address, BGT_ABI, api)
     result = bgt.functions.boostees(wallet).call()
     return result
 
 
 def get_bera_unboosted(bgt_address, wallet, api):
-    bgt = create_contract(bgt_address, "./abi/BGT.json", api)
+    bgt = create_contract(bgt_address, BGT_ABI, api)
     result = bgt.functions.unboostedBalanceOf(wallet).call()
     return result
 
 
 def get_bera_queued_boost(bgt_address, wallet, api):
-    bgt = create_contract(bgt_address, "./abi/BGT.json", api)
+    bgt = create_contract(bgt_address, BGT_ABI, api)
     result = bgt.functions.queuedBoost(wallet).call()
     return result
+
+
+def get_bera_bgt_figures(bgt_address, wallet, api):
+    """Get every BGT figure of a wallet in one pass on the cached contract
+
+    Returns:
+      A dict of BGT function name to its raw result
+    """
+    bgt = create_contract(bgt_address, BGT_ABI, api)
+    return {name: bgt.functions[name](wallet).call() for name in BGT_READS}
@@ -0,0 +1,107 @@
+"""Scrape driven collection of the wallet metrics"""
+
+import threading
+import time
+from concurrent.futures import Future, wait
+
+
+class ScrapeCollector:
+    """
+    prometheus_client collector refreshing the networks on scrape.
+
+    A scrape refreshes the networks whose values are older than their ttl
+    and returns the cached values of the others. Concurrent scrapes share
+    the in flight refresh of a network, so the upstream load depends on
+    the ttl and not on the number of scrapers. A scrape waits at most
+    scrape_timeout for the refreshes and serves the cached values of the
+    networks that are not done yet.
+    """
+
+    def __init__(self, networks, fetch_network, metrics, logging, scrape_timeout=8):
+        """
+        Args:
+          networks: list of (network, ttl in seconds) tuples
+          fetch_network: callable(network) refreshing the metrics of a network
+          metrics: metrics returned on scrape, refreshed by fetch_network
+          scrape_timeout: maximum time a scrape waits for the refreshes
+        """
+        self.networks = networks
+        self.fetch_network = fetch_network
+        self.metrics = metrics
+        self.logging = logging
+        self.scrape_timeout = scrape_timeout
+
+        self._lock = threading.Lock()
+        self._refreshed_at = {}
+        self._in_flight = {}
+
+    def update_networks(self, networks):
+        """Replace the collected networks
+
+        The new networks and the ones whose config changed are refreshed on
+        the next scrape, the others keep their cached values.
+        """
+        with self._lock:
+            previous = {network["name"]: network for network, _ in self.networks}
+            names = {network["name"] for network, _ in networks}
+            for name in set(previous) - names:
+                self._refreshed_at.pop(name, None)
+            for network, _ in networks:
+                if previous.get(network["name"]) != network:
+                    self._refreshed_at.pop(network["name"], None)
+            self.networks = networks
+
+    def _refresh(self, network, future):
+        try:
+            self.fetch_network(network)
+        except Exception as e:
+            self.logging.error(f"Fetching {network['name']} failed: {e}")
+        with self._lock:
+            # a network replaced meanwhile is refreshed again
+            if any(current is network for current, _ in self.networks):
+                self._refreshed_at[network["name"]] = time.monotonic()
+            del self._in_flight[network["name"]]
+        future.set_result(None)
+
+    def refresh_stale(self):
+        """Start the refresh of every stale network
+
+        Returns:
+          The futures of the refreshes in flight, new or shared
+        """
+        futures = []
+        now = time.monotonic()
+        with self._lock:
+            for network, ttl in self.networks:
+                name = network["name"]
+                future = self._in_flight.get(name)
+                if future is None:
+                    if now - self._refreshed_at.get(name, float("-inf")) < ttl:
+                        continue
+                    future = Future()
+                    self._in_flight[name] = future
+                    threading.Thread(
+                        target=self._refresh,
+                        args=(network, future),
+                        name=f"refresh-{name}",
+                        daemon=True,
+                    ).start()
+                futures.append(future)
+        return futures
+
+    def describe(self):
+        # keeps the registry from running a scrape when registering
+        for metric in self.metrics:
+            yield from metric.describe()
+
+    def collect(self):
+        futures = self.refresh_stale()
+        if futures:
+            _, not_done = wait(futures, timeout=self.scrape_timeout)
+            if not_done:
+                self.logging.warning(
+                    f"{len(not_done)} network(s) still refreshing, "
+                    "serving cached values"
+                )
+        for metric in self.metrics:
+            yield from metric.collect()
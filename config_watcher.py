@@ -0,0 +1,106 @@
+"""Reload of the config file while the exporter runs"""
+
+import os
+import threading
+
+from utils import read_config_file
+
+
+class ConfigWatcher:
+    """
+    Poll the modification time of the config file, and of the wallets files
+    it points at, and hand every new valid version to on_change.
+
+    A change is only read once the file has stayed the same for a whole
+    interval, so a file being written is not loaded half done. An invalid
+    file is logged and the running config is kept.
+    """
+
+    def __init__(self, path, on_change, logging, interval=5):
+        """
+        Args:
+          path: config file path
+          on_change: callable(config) run with every new config
+          interval: seconds between 2 checks of the file
+        """
+        self.path = path
+        self.on_change = on_change
+        self.logging = logging
+        self.interval = interval
+
+        self._stop = threading.Event()
+        self._thread = None
+        self._loaded = None
+        self._paths = (path,)
+
+    def _watch(self, config):
+        """Watch the config file and the wallets files of a config"""
+        self._paths = (self.path,) + tuple(
+            network["wallets_file"]
+            for network in config["networks"]
+            if "wallets_file" in network
+        )
+
+    def _stat(self):
+        stats = []
+        for path in self._paths:
+            stat = os.stat(path)
+            stats.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(stats)
+
+    def _reload(self):
+        try:
+            messages, config = read_config_file(self.path)
+        except Exception as e:
+            messages, config = e, None
+        if not config:
+            self.logging.error(
+                f"config file {self.path} is incorrect, keeping the running "
+                f"config: {messages}"
+            )
+            return
+        self.logging.info(f"Reloading config file {self.path}")
+        try:
+            self.on_change(config)
+        except Exception as e:
+            self.logging.error(f"Reloading config file {self.path} failed: {e}")
+            return
+        self._watch(config)
+        try:
+            self._loaded = self._stat()
+        except OSError:
+            # seen again, and reported, by the next check
+            self._loaded = None
+
+    def _loop(self):
+        pending = None
+        while not self._stop.wait(self.interval):
+            try:
+                stat = self._stat()
+            except OSError as e:
+                self.logging.error(f"Cannot read config file: {e}")
+                continue
+            if stat == self._loaded:
+                pending = None
+            elif stat == pending:
+                # unchanged for an interval, the write is over
+                self._loaded, pending = stat, None
+                self._reload()
+            else:
+                pending = stat
+
+    def start(self, config=None):
+        """
+        Args:
+          config: the running config, whose wallets files are watched too
+        """
+        if config is not None:
+            self._watch(config)
+        self._loaded = self._stat()
+        self._thread = threading.Thread(
+            target=self._loop, name="config-watcher", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
@@ -1,4 +1,223 @@
-from utils import http_json_call
+import asyncio
+import threading
+import time
+
+from resilience import is_endpoint_failure
+from utils import HttpCallError, async_http_json_call, http_json_call
+
+COSMOS_REGISTRY_URLS = {
+    "mainnet": "https://chains.cosmos.directory",
+    "testnet": "https://chains.testcosmos.directory",
+}
+
+# recent ibc-go versions only serve denoms, older ones only denom_traces
+IBC_DENOM_ROUTES = ("ibc/apps/transfer/v1/denom_traces", "ibc/apps/transfer/v1/denoms")
+# statuses of a node not serving a route
+MISSING_ROUTE_STATUSES = (404, 501)
+# statuses of a node having no metadata for a denom, or no such query
+NO_METADATA_STATUSES = (400, 404, 501)
+# seconds before a denom that could not be resolved is tried again
+DENOM_RETRY_SECONDS = 600
+# same after an endpoint failure, which should not last as long
+DENOM_TRANSIENT_RETRY_SECONDS = 30
+
+
+def _parse_denom_trace(d):
+    """Return the base denom of an ibc denom trace response"""
+    if "denom_trace" in d:
+        return d["denom_trace"]["base_denom"]
+    return d["denom"]["base"]
+
+
+def _denom_info(base_denom, metadata):
+    """Return the symbol and exponent of a denom from its bank metadata"""
+    if metadata:
+        for unit in metadata.get("denom_units", []):
+            if unit["denom"] == metadata.get("display"):
+                return {
+                    "symbol": metadata.get("symbol") or metadata["display"].upper(),
+                    "exponent": unit.get("exponent", 0),
+                }
+    # no metadata, the raw amount of the base denom is exported
+    return {"symbol": base_denom, "exponent": 0}
+
+
+def _get_denom_trace(apiprovider, denom, rpc_call_status_counter):
+    """Return the trace of an ibc denom from the first route the node serves"""
+    error = None
+    for route in IBC_DENOM_ROUTES:
+        try:
+            return http_json_call(
+                url=f"{apiprovider}/{route}/{denom[4:]}",
+                rpc_call_status_counter=rpc_call_status_counter,
+                params={},
+            )
+        except HttpCallError as e:
+            if e.status not in MISSING_ROUTE_STATUSES:
+                raise
+            error = e
+    raise error
+
+
+def _get_denom_metadata(apiprovider, denom, rpc_call_status_counter):
+    """Return the bank metadata of a denom, None if the node has none"""
+    try:
+        d = http_json_call(
+            url=f"{apiprovider}/cosmos/bank/v1beta1/denoms_metadata_by_query_string",
+            rpc_call_status_counter=rpc_call_status_counter,
+            params={"denom": denom},
+        )
+    except HttpCallError as e:
+        if e.status not in NO_METADATA_STATUSES:
+            raise
+        return None
+    return d.get("metadata")
+
+
+async def _async_get_denom_trace(session, apiprovider, denom, rpc_call_status_counter):
+    error = None
+    for route in IBC_DENOM_ROUTES:
+        try:
+            return await async_http_json_call(
+                session=session,
+                url=f"{apiprovider}/{route}/{denom[4:]}",
+                rpc_call_status_counter=rpc_call_status_counter,
+                params={},
+            )
+        except HttpCallError as e:
+            if e.status not in MISSING_ROUTE_STATUSES:
+                raise
+            error = e
+    raise error
+
+
+async def _async_get_denom_metadata(
+    session, apiprovider, denom, rpc_call_status_counter
+):
+    try:
+        d = await async_http_json_call(
+            session=session,
+            url=f"{apiprovider}/cosmos/bank/v1beta1/denoms_metadata_by_query_string",
+            rpc_call_status_counter=rpc_call_status_counter,
+            params={"denom": denom},
+        )
+    except HttpCallError as e:
+        if e.status not in NO_METADATA_STATUSES:
+            raise
+        return None
+    return d.get("metadata")
+
+
+class DenomResolver:
+    """
+    Symbol and exponent of bank denoms, resolved once per (api, denom)
+    from the ibc denom trace and the bank denom metadata, which never
+    change for a given denom.
+
+    A denom that could not be resolved fails fast with its last error for
+    DENOM_RETRY_SECONDS, so its holders do not query it again every cycle,
+    or only for DENOM_TRANSIENT_RETRY_SECONDS after an endpoint failure.
+    """
+
+    def __init__(self):
+        self._denoms = {}
+        # (api, denom) to the last resolution error message and when to retry
+        self._failures = {}
+        self._lock = threading.Lock()
+        self._tasks = {}
+
+    def _cached(self, key):
+        """Return the resolved denom or None, raising while a failure is recent"""
+        info = self._denoms.get(key)
+        if info is None:
+            failure = self._failures.get(key)
+            if failure is not None and time.monotonic() < failure[1]:
+                raise Exception(f"{failure[0]} (retried later)")
+        return info
+
+    def _failed(self, key, error):
+        if is_endpoint_failure(error):
+            retry = DENOM_TRANSIENT_RETRY_SECONDS
+        else:
+            retry = DENOM_RETRY_SECONDS
+        self._failures[key] = (str(error), time.monotonic() + retry)
+
+    def _resolved(self, key, info):
+        self._denoms[key] = info
+        self._failures.pop(key, None)
+
+    def resolve(self, apiprovider, denom, rpc_call_status_counter):
+        key = (apiprovider, denom)
+        info = self._cached(key)
+        if info is not None:
+            return info
+        # wallets holding the same new denom wait for a single resolution
+        with self._lock:
+            info = self._cached(key)
+            if info is None:
+                try:
+                    base_denom = denom
+                    if denom.startswith("ibc/"):
+                        base_denom = _parse_denom_trace(
+                            _get_denom_trace(
+                                apiprovider, denom, rpc_call_status_counter
+                            )
+                        )
+                    info = _denom_info(
+                        base_denom,
+                        _get_denom_metadata(
+                            apiprovider, denom, rpc_call_status_counter
+                        ),
+                    )
+                except Exception as e:
+                    self._failed(key, e)
+                    raise
+                self._resolved(key, info)
+        return info
+
+    async def async_resolve(self, session, apiprovider, denom, rpc_call_status_counter):
+        key = (apiprovider, denom)
+        info = self._cached(key)
+        if info is not None:
+            return info
+        # wallets holding the same new denom wait for a single resolution
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(
+                self._async_resolve(
+                    session, apiprovider, denom, rpc_call_status_counter
+                )
+            )
+            self._tasks[key] = task
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if task.done():
+                self._tasks.pop(key, None)
+
+    async def _async_resolve(
+        self, session, apiprovider, denom, rpc_call_status_counter
+    ):
+        key = (apiprovider, denom)
+        try:
+            base_denom = denom
+            if denom.startswith("ibc/"):
+                base_denom = _parse_denom_trace(
+                    await _async_get_denom_trace(
+                        session, apiprovider, denom, rpc_call_status_counter
+                    )
+                )
+            info = _denom_info(
+                base_denom,
+                await _async_get_denom_metadata(
+                    session, apiprovider, denom, rpc_call_status_counter
+                ),
+            )
+        except Exception as e:
+            self._failed(key, e)
+            raise
+        self._resolved(key, info)
+        return info
 
 
 def get_coins_balances(restprovider, addr: str, rpc_call_status_counter):
@@ -9,11 +228,9 @@ def get_coins_balances(restprovider, addr: str, rpc_call_status_counter):
             rpc_call_status_counter=rpc_call_status_counter,
             params={},
         )
-        if "balances" in d:
-            for i in d["balances"]:
-                coins[i["denom"]] = i["amount"]
-            return coins
-        return 0
+        for i in d.get("balances", []):
+            coins[i["denom"]] = i["amount"]
+        return coins
     except Exception as addr_balancer_err:
         raise addr_balancer_err
 
@@ -25,10 +242,9 @@ def get_maincoin_balance(apiprovider, addr: str, maindenom, rpc_call_status_coun
             rpc_call_status_counter=rpc_call_status_counter,
             params={},
         )
-        if "balances" in str(d):
-            for i in d["balances"]:
-                if i["denom"] == maindenom:
-                    return i["amount"]
+        for i in d.get("balances", []):
+            if i["denom"] == maindenom:
+                return i["amount"]
         return 0
     except Exception as addr_balancer_err:
         raise addr_balancer_err
@@ -105,13 +321,23 @@ def get_rewards(apiprovider, addr: str, maindenom, rpc_call_status_counter):
         raise addr_balancer_err
 
 
+def get_latest_height(rpcprovider, rpc_call_status_counter):
+    """Return the latest block height of a node from its rpc /status"""
+    d = http_json_call(
+        url=f"{rpcprovider}/status",
+        rpc_call_status_counter=rpc_call_status_counter,
+        params={},
+    )
+    return int(d["result"]["sync_info"]["latest_block_height"])
+
+
 def get_cosmos_registry(network, rpc_call_status_counter):
     try:
         params: dict = {}
         registry_url = (
-            "https://chains.cosmos.directory"
+            COSMOS_REGISTRY_URLS["mainnet"]
             if network == "mainnet"
-            else "https://chains.testcosmos.directory"
+            else COSMOS_REGISTRY_URLS["testnet"]
         )
         d = http_json_call(
             url=registry_url,
@@ -122,3 +348,83 @@ def get_cosmos_registry(network, rpc_call_status_counter):
         return d["chains"]
     except Exception as err:
         raise err
+
+
+async def async_get_coins_balances(
+    session, restprovider, addr: str, rpc_call_status_counter
+):
+    d = await async_http_json_call(
+        session=session,
+        url=f"{restprovider}/cosmos/bank/v1beta1/balances/{addr}",
+        rpc_call_status_counter=rpc_call_status_counter,
+        params={},
+    )
+    return {i["denom"]: i["amount"] for i in d.get("balances", [])}
+
+
+async def async_get_delegations(
+    session, apiprovider, addr: str, maindenom, rpc_call_status_counter
+):
+    params: dict = {}
+    total_delegations = float(0)
+    while True:
+        d = await async_http_json_call(
+            session=session,
+            url=f"{apiprovider}/cosmos/staking/v1beta1/delegations/{addr}",
+            rpc_call_status_counter=rpc_call_status_counter,
+            params=params,
+        )
+
+        for i in d["delegation_responses"]:
+            if i["balance"]["denom"] == maindenom:
+                total_delegations = total_delegations + float(i["balance"]["amount"])
+        if d["pagination"]["next_key"] is not None:
+            params = {
+                "pagination.key": d["pagination"]["next_key"],
+            }
+        else:
+            break
+    return total_delegations
+
+
+async def async_get_unbonding_delegations(
+    session, apiprovider, addr: str, rpc_call_status_counter
+):
+    params: dict = {}
+    total_unbounding_delegations = float(0)
+    while True:
+        d = await async_http_json_call(
+            session=session,
+            url=f"{apiprovider}/cosmos/staking/v1beta1/delegators/{addr}/unbonding_delegations",
+            rpc_call_status_counter=rpc_call_status_counter,
+            params=params,
+        )
+
+        for i in d["unbonding_responses"]:
+            for entry in i["entries"]:
+                total_unbounding_delegations = total_unbounding_delegations + float(
+                    entry["balance"]
+                )
+        if d["pagination"]["next_key"] is not None:
+            params = {
+                "pagination.key": d["pagination"]["next_key"],
+            }
+        else:
+            break
+    return total_unbounding_delegations
+
+
+async def async_get_rewards(
+    session, apiprovider, addr: str, maindenom, rpc_call_status_counter
+):
+    d = await async_http_json_call(
+        session=session,
+        url=f"{apiprovider}/cosmos/distribution/v1beta1/delegators/{addr}/rewards",
+        rpc_call_status_counter=rpc_call_status_counter,
+        params={},
+    )
+
+    for i in d["total"]:
+        if i["denom"] == maindenom:
+            return i["amount"]
+    return 0
@@ -0,0 +1,267 @@
+"""Latency aware selection of the api/rpc endpoints of a network"""
+
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from executor import endpoint_host
+from resilience import CircuitOpenError, CircuitState, is_endpoint_failure
+from telemetry import call_method
+from utils import request_timeout
+
+# latencies kept per endpoint to compute the hedging delay
+LATENCY_WINDOW = 100
+# a p95 needs a few samples to mean anything
+MIN_HEDGE_SAMPLES = 10
+
+
+def endpoint_urls(network, key):
+    """Return the endpoints of a network as a list, api/rpc being a url or a list"""
+    urls = network[key]
+    if isinstance(urls, str):
+        return [urls]
+    return list(urls)
+
+
+class EndpointStats:
+    def __init__(self):
+        self.ewma = None
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def record(self, latency, alpha):
+        if self.ewma is None:
+            self.ewma = latency
+        else:
+            self.ewma = alpha * latency + (1 - alpha) * self.ewma
+
+    def p95(self):
+        if len(self.latencies) < MIN_HEDGE_SAMPLES:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[int(0.95 * (len(latencies) - 1))]
+
+
+class Endpoints:
+    """
+    Run calls on the fastest endpoint of a list, failing over to the next
+    ones.
+
+    Endpoints are ranked by a moving average of their latency for the
+    method of the call (see telemetry.call_context), endpoints never
+    called first so they get measured, and the ones whose circuit is open
+    last. A failure counts as a request timeout latency so a
+    failing endpoint drops in the ranking. Every attempt goes through the
+    circuit breaker of its host. Errors that are not endpoint failures,
+    like a 400 for a bad address, are the answer of the endpoint: they
+    are raised without trying the next endpoints.
+
+    Hedged calls start a duplicate call on the next endpoint when the
+    first one has not answered after its p95 latency, the first success
+    wins. They are meant for single requests whose result is only returned.
+    The duplicate runs on the executor, and is not started when the host of
+    the next endpoint already has its maximum of jobs in flight. Async
+    duplicates share the per host connection limit of their session.
+    """
+
+    def __init__(self, breakers, executor, alpha=0.2, hedge_workers=16):
+        self.breakers = breakers
+        self.executor = executor
+        self.alpha = alpha
+
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._hedge_pool = ThreadPoolExecutor(
+            max_workers=hedge_workers, thread_name_prefix="hedge"
+        )
+
+    def _get_stats(self, url, method):
+        with self._lock:
+            stats = self._stats.get((url, method))
+            if stats is None:
+                stats = EndpointStats()
+                self._stats[(url, method)] = stats
+            return stats
+
+    def _record(self, url, latency, success):
+        stats = self._get_stats(url, call_method())
+        with self._lock:
+            if success:
+                stats.latencies.append(latency)
+            else:
+                latency = max(latency, request_timeout())
+            stats.record(latency, self.alpha)
+
+    def ranked(self, urls, method=None):
+        """Return the endpoints from the most to the least preferred
+
+        Args:
+          method: method the endpoints are ranked for, the one of the
+            current call context if None
+        """
+        method = method or call_method()
+
+        def rank(url):
+            circuit_open = (
+                self.breakers.get(endpoint_host(url)).state == CircuitState.OPEN
+            )
+            return (circuit_open, self._get_stats(url, method).ewma or 0)
+
+        return sorted(urls, key=rank)
+
+    def best(self, urls, method=None):
+        return self.ranked(urls, method)[0]
+
+    def _hedge_delay(self, url):
+        stats = self._get_stats(url, call_method())
+        with self._lock:
+            return stats.p95()
+
+    def _attempt(self, url, fn):
+        start = time.monotonic()
+        try:
+            result = self.breakers.call(endpoint_host(url), fn, url)
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            self._record(url, time.monotonic() - start, not is_endpoint_failure(e))
+            raise
+        self._record(url, time.monotonic() - start, True)
+        return result
+
+    def call(self, urls, fn, hedge=False):
+        """Return fn(url) from the first endpoint answering without error
+
+        Args:
+          urls: endpoints to choose from
+          fn: callable(url) doing the call
+          hedge: race a duplicate call past the p95 latency of the endpoint
+        """
+        ranked = self.ranked(urls)
+        delay = self._hedge_delay(ranked[0]) if hedge and len(ranked) > 1 else None
+        if delay is not None:
+            return self._hedged_call(ranked, fn, delay)
+
+        error = None
+        for url in ranked:
+            try:
+                return self._attempt(url, fn)
+            except Exception as e:
+                if not is_endpoint_failure(e):
+                    raise
+                error = e
+        raise error
+
+    def _submit_attempt(self, url, fn):
+        # the attempt runs in the context of the caller, for the call labels
+        context = contextvars.copy_context()
+        return self._hedge_pool.submit(context.run, self._attempt, url, fn)
+
+    def _submit_duplicate(self, url, fn):
+        context = contextvars.copy_context()
+        return self.executor.try_submit(url, context.run, self._attempt, url, fn)
+
+    def _hedged_call(self, ranked, fn, delay):
+        remaining = deque(ranked)
+        pending = {self._submit_attempt(remaining.popleft(), fn)}
+        hedged = False
+        error = None
+        while True:
+            done, pending = wait(
+                pending,
+                timeout=None if hedged else delay,
+                return_when=FIRST_COMPLETED,
+            )
+            for future in done:
+                if future.exception() is None or not is_endpoint_failure(
+                    future.exception()
+                ):
+                    for other in pending:
+                        other.cancel()
+                    return future.result()
+                error = future.exception()
+            if done:
+                # a failed call fails over to the next endpoint
+                if remaining:
+                    pending.add(self._submit_attempt(remaining.popleft(), fn))
+            elif remaining:
+                # past the delay, one duplicate if the next host has room
+                hedged = True
+                duplicate = self._submit_duplicate(remaining[0], fn)
+                if duplicate is not None:
+                    remaining.popleft()
+                    pending.add(duplicate)
+            else:
+                hedged = True
+            if not pending:
+                raise error
+
+    async def _async_attempt(self, url, coro_fn):
+        breaker = self.breakers.get(endpoint_host(url))
+        if not breaker.allow():
+            raise CircuitOpenError(f"circuit open for {endpoint_host(url)}")
+        start = time.monotonic()
+        try:
+            result = await coro_fn(url)
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except Exception as e:
+            failure = is_endpoint_failure(e)
+            if failure:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            self._record(url, time.monotonic() - start, not failure)
+            raise
+        breaker.record_success()
+        self._record(url, time.monotonic() - start, True)
+        return result
+
+    async def async_call(self, urls, coro_fn, hedge=False):
+        """Async version of call, coro_fn(url) returning a coroutine"""
+        ranked = self.ranked(urls)
+        delay = self._hedge_delay(ranked[0]) if hedge and len(ranked) > 1 else None
+        if delay is None:
+            error = None
+            for url in ranked:
+                try:
+                    return await self._async_attempt(url, coro_fn)
+                except Exception as e:
+                    if not is_endpoint_failure(e):
+                        raise
+                    error = e
+            raise error
+
+        remaining = iter(ranked)
+        first = asyncio.ensure_future(self._async_attempt(next(remaining), coro_fn))
+        await asyncio.wait([first], timeout=delay)
+        pending = {first}
+        error = None
+        if first.done():
+            if first.exception() is None or not is_endpoint_failure(first.exception()):
+                return first.result()
+            pending, error = set(), first.exception()
+        try:
+            while True:
+                url = next(remaining, None)
+                if url is not None:
+                    pending.add(
+                        asyncio.ensure_future(self._async_attempt(url, coro_fn))
+                    )
+                if not pending:
+                    raise error
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None or not is_endpoint_failure(
+                        task.exception()
+                    ):
+                        return task.result()
+                    error = task.exception()
+        finally:
+            for task in pending:
+                task.cancel()
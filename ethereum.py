@@ -1,12 +1,242 @@
+import json
+import os
+import threading
+
+import requests
 from metrics_enum import MetricsUrlStatus, TokenType
-from utils import http_json_call
+from requests.adapters import HTTPAdapter
+from telemetry import timed_call
+from utils import http_json_call, request_timeout
 from web3 import Web3
+from web3.middleware import Web3Middleware
+
+# process wide Web3 clients, sessions and chain ids, keyed by endpoint
+_web3_clients: dict = {}
+_sessions: dict = {}
+_chain_ids: dict = {}
+_web3_lock = threading.Lock()
+
+EVM_CHAINS_URL = "https://chainid.network/chains.json"
+WEB3_POOL_SIZE = 32
+JSON_RPC_BATCH_SIZE = 100
+
+
+class TimingMiddleware(Web3Middleware):
+    """Record the duration of every request made by a Web3 client"""
+
+    def wrap_make_request(self, make_request):
+        url = self._w3.provider.endpoint_uri
+
+        def middleware(method, params):
+            with timed_call(url):
+                return make_request(method, params)
+
+        return middleware
+
+
+def get_web3(apiprovider):
+    """Return the shared Web3 client of an endpoint, creating it on first use
+
+    Every client owns a pooled requests session, so calls to the same
+    endpoint reuse warm keep-alive connections, and caches the requests
+    whose answer never changes, such as the eth_chainId lookups done by
+    the web3 validation middleware.
+    """
+    with _web3_lock:
+        web3 = _web3_clients.get(apiprovider)
+        if web3 is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=WEB3_POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[apiprovider] = session
+            web3 = Web3(
+                Web3.HTTPProvider(
+                    apiprovider,
+                    session=session,
+                    cache_allowed_requests=True,
+                    request_kwargs={"timeout": request_timeout()},
+                )
+            )
+            web3.middleware_onion.add(TimingMiddleware)
+            _web3_clients[apiprovider] = web3
+        return web3
+
+
+def get_chain_id(apiprovider):
+    """Return the chain id of an endpoint, resolved once per endpoint"""
+    chain_id = _chain_ids.get(apiprovider)
+    if chain_id is None:
+        chain_id = get_web3(apiprovider).eth.chain_id
+        _chain_ids[apiprovider] = chain_id
+    return chain_id
+
+
+def get_block_number(apiprovider, rpc_call_status_counter):
+    """Return the latest block number of an endpoint"""
+    try:
+        block_number = get_web3(apiprovider).eth.block_number
+    except Exception as err:
+        rpc_call_status_counter.labels(
+            url=apiprovider, status=MetricsUrlStatus.FAILED.value
+        ).inc()
+        raise err
+    rpc_call_status_counter.labels(
+        url=apiprovider, status=MetricsUrlStatus.SUCCESS.value
+    ).inc()
+    return block_number
+
+
+def json_rpc_batch(apiprovider, calls, rpc_call_status_counter):
+    """Send a list of JSON-RPC calls as a single batch request
+
+    Args:
+      apiprovider: JSON-RPC endpoint
+      calls: list of (method, params) tuples
+      rpc_call_status_counter: Prometheus counter for RPC call status
+    Returns:
+      The list of responses, in the order of calls
+    """
+    get_web3(apiprovider)
+    payload = [
+        {"jsonrpc": "2.0", "id": i, "method": method, "params": params}
+        for i, (method, params) in enumerate(calls)
+    ]
+    try:
+        with timed_call(apiprovider):
+            r = _sessions[apiprovider].post(
+                apiprovider, json=payload, timeout=request_timeout()
+            )
+        r.raise_for_status()
+        d = r.json()
+        if not isinstance(d, list):
+            # some providers answer a whole batch with a single error
+            raise Exception(f"JSON-RPC batch rejected: {d}")
+    except Exception as err:
+        rpc_call_status_counter.labels(
+            url=apiprovider, status=MetricsUrlStatus.FAILED.value
+        ).inc()
+        raise err
+    rpc_call_status_counter.labels(
+        url=apiprovider, status=MetricsUrlStatus.SUCCESS.value
+    ).inc()
+
+    responses = {response.get("id"): response for response in d}
+    return [responses.get(i, {}) for i in range(len(calls))]
+
+
+def get_blocks_touched_addresses(apiprovider, block_numbers, rpc_call_status_counter):
+    """Return the addresses whose native balance may change in some blocks
+
+    Those are the senders and recipients of the transactions, the fee
+    recipient and the withdrawal addresses. Value moved by internal calls
+    is not visible there.
+
+    Args:
+      apiprovider: JSON-RPC endpoint
+      block_numbers: list of block numbers
+      rpc_call_status_counter: Prometheus counter for RPC call status
+    Returns:
+      A set of lower case addresses
+    """
+    responses = json_rpc_batch(
+        apiprovider,
+        [("eth_getBlockByNumber", [hex(number), True]) for number in block_numbers],
+        rpc_call_status_counter,
+    )
+    addresses = set()
+    for response in responses:
+        block = response.get("result")
+        if block is None:
+            raise Exception(f"Cannot read block: {response.get('error')}")
+        addresses.add(block["miner"])
+        for tx in block["transactions"]:
+            addresses.add(tx["from"])
+            if tx.get("to"):
+                addresses.add(tx["to"])
+        for withdrawal in block.get("withdrawals", []):
+            addresses.add(withdrawal["address"])
+    return {address.lower() for address in addresses}
+
+
+def get_ethereum_balances_batch(
+    apiprovider, addresses, rpc_call_status_counter, batch_size=JSON_RPC_BATCH_SIZE
+):
+    """Get the native balance of many addresses with JSON-RPC batches
+
+    Every balance is read at the same block, resolved once beforehand.
+
+    Args:
+      apiprovider: JSON-RPC endpoint
+      addresses: list of addresses
+      rpc_call_status_counter: Prometheus counter for RPC call status
+      batch_size: maximum number of calls in a single batch request
+    Returns:
+      A Tuple (the block number, a dict of address to balance in ether).
+      Addresses whose call failed are missing from the dict.
+    """
+    web3 = get_web3(apiprovider)
+    block_number = web3.eth.block_number
+    block_tag = hex(block_number)
+
+    # the same address can be configured several times
+    addresses = list(dict.fromkeys(addresses))
+    balances = {}
+    for start in range(0, len(addresses), batch_size):
+        chunk = addresses[start : start + batch_size]
+        responses = json_rpc_batch(
+            apiprovider,
+            [("eth_getBalance", [addr, block_tag]) for addr in chunk],
+            rpc_call_status_counter,
+        )
+        for addr, response in zip(chunk, responses):
+            if response.get("result") is not None:
+                balances[addr] = web3.from_wei(int(response["result"], 16), "ether")
+    return block_number, balances
+
+
+class TokenMetadataCache:
+    """
+    ERC-20 decimals and symbol keyed by (chain id, contract address).
+
+    They never change for a deployed token, so they are read once, shared
+    by every wallet holding the token and persisted to a json file so a
+    restart starts warm.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._tokens = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, "r") as f:
+                self._tokens = json.load(f)
+
+    @staticmethod
+    def _key(chain_id, contract_address):
+        return f"{chain_id}:{contract_address.lower()}"
+
+    def get(self, chain_id, contract_address):
+        """Return a dict with decimals and symbol, None if unknown"""
+        return self._tokens.get(self._key(chain_id, contract_address))
+
+    def set(self, chain_id, contract_address, decimals, symbol):
+        with self._lock:
+            self._tokens[self._key(chain_id, contract_address)] = {
+                "decimals": decimals,
+                "symbol": symbol,
+            }
+            if self.path:
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(self._tokens, f)
+                os.replace(tmp_path, self.path)
 
 
 def get_evm_chains_data(rpc_call_status_counter):
     try:
         d = http_json_call(
-            url="https://chainid.network/chains.json",
+            url=EVM_CHAINS_URL,
             rpc_call_status_counter=rpc_call_status_counter,
             params={},
         )
@@ -16,10 +246,11 @@ def get_evm_chains_data(rpc_call_status_counter):
 
 
 def get_chain_symbol(chain_id, chain_data):
-    for chain in chain_data:
-        if chain["chainId"] == chain_id:
-            return chain["nativeCurrency"]["symbol"]
-    return "Unknown"
+    """Return the native symbol of a chain from the chain id index"""
+    chain = chain_data.get(chain_id)
+    if chain is None:
+        return "Unknown"
+    return chain.symbol
 
 
 def get_ethereum_balance(apiprovider, wallet, rpc_call_status_counter, chains_evm):
@@ -27,10 +258,10 @@ def get_ethereum_balance(apiprovider, wallet, rpc_call_status_counter, chains_ev
         balances = []
         addr = wallet["address"]
 
-        web3 = Web3(Web3.HTTPProvider(apiprovider))
+        web3 = get_web3(apiprovider)
         balance = web3.eth.get_balance(addr)
         balance_ether = web3.from_wei(balance, "ether")
-        chain_id = web3.eth.chain_id
+        chain_id = get_chain_id(apiprovider)
         symbol = get_chain_symbol(chain_id=chain_id, chain_data=chains_evm)
         rpc_call_status_counter.labels(
             url=apiprovider, status=MetricsUrlStatus.SUCCESS.value
@@ -72,7 +303,11 @@ def get_ethereum_balance(apiprovider, wallet, rpc_call_status_counter, chains_ev
 
 
 def get_erc20_balance(
-    apiprovider, addr: str, contract_address: str, rpc_call_status_counter
+    apiprovider,
+    addr: str,
+    contract_address: str,
+    rpc_call_status_counter,
+    token_metadata=None,
 ):
     minABI = [
         {
@@ -99,11 +334,21 @@ def get_erc20_balance(
             "type": "function",
         },
     ]
-    web3 = Web3(Web3.HTTPProvider(apiprovider))
+    web3 = get_web3(apiprovider)
     contract = web3.eth.contract(address=contract_address, abi=minABI)
     balance = contract.functions.balanceOf(addr).call()
-    decimals = contract.functions.decimals().call()
-    symbol = contract.functions.symbol().call()
+    metadata = None
+    if token_metadata is not None:
+        chain_id = get_chain_id(apiprovider)
+        metadata = token_metadata.get(chain_id, contract_address)
+    if metadata is None:
+        decimals = contract.functions.decimals().call()
+        symbol = contract.functions.symbol().call()
+        if token_metadata is not None:
+            token_metadata.set(chain_id, contract_address, decimals, symbol)
+    else:
+        decimals = metadata["decimals"]
+        symbol = metadata["symbol"]
     adjusted_balance = balance / (10**decimals)
     rpc_call_status_counter.labels(
         url=apiprovider, status=MetricsUrlStatus.SUCCESS.value
@@ -0,0 +1,99 @@
+"""Concurrent fetch execution engine"""
+
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlparse
+
+
+def endpoint_host(url):
+    """Return the host part of an endpoint url, used to group jobs"""
+    parsed_url = urlparse(url)
+    return parsed_url.netloc or url
+
+
+class FetchExecutor:
+    """
+    Thread pool that fans out fetch jobs while capping the number of jobs
+    in flight against a single RPC/API host.
+
+    Jobs over the per host cap are parked in a per host queue instead of
+    blocking a worker, so a slow endpoint never starves the others.
+    """
+
+    def __init__(self, max_workers=16, max_in_flight_per_host=4):
+        self.max_workers = max_workers
+        self.max_in_flight_per_host = max_in_flight_per_host
+
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="fetch"
+        )
+        self._lock = threading.Lock()
+        self._in_flight = defaultdict(int)
+        self._pending = defaultdict(deque)
+
+    def submit(self, url, fn, *args, **kwargs):
+        """Schedule fn(*args, **kwargs) against the host of url
+
+        Args:
+          url: endpoint the job talks to
+          fn: callable to run
+        Returns:
+          A concurrent.futures.Future
+        """
+        host = endpoint_host(url)
+        job = (Future(), fn, args, kwargs)
+
+        with self._lock:
+            if self._in_flight[host] < self.max_in_flight_per_host:
+                self._in_flight[host] += 1
+                start = True
+            else:
+                self._pending[host].append(job)
+                start = False
+
+        if start:
+            self._pool.submit(self._run, host, job)
+        return job[0]
+
+    def try_submit(self, url, fn, *args, **kwargs):
+        """Schedule fn(*args, **kwargs) like submit, unless the host is busy
+
+        Returns:
+          A concurrent.futures.Future, or None if the host of url already
+          has max_in_flight_per_host jobs in flight
+        """
+        host = endpoint_host(url)
+        job = (Future(), fn, args, kwargs)
+
+        with self._lock:
+            if self._in_flight[host] >= self.max_in_flight_per_host:
+                return None
+            self._in_flight[host] += 1
+
+        self._pool.submit(self._run, host, job)
+        return job[0]
+
+    def _run(self, host, job):
+        future, fn, args, kwargs = job
+        if future.set_running_or_notify_cancel():
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as err:
+                future.set_exception(err)
+            else:
+                future.set_result(result)
+
+        with self._lock:
+            pending = self._pending[host]
+            if pending:
+                next_job = pending.popleft()
+            else:
+                next_job = None
+                self._in_flight[host] -= 1
+
+        if next_job is not None:
+            self._pool.submit(self._run, host, next_job)
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
@@ -1,29 +1,84 @@
 """Application exporter"""
 
 import argparse
+import asyncio
 import os
+import threading
 import time
+from collections import defaultdict
+from concurrent.futures import wait
+from functools import partial
 
-from bera import (
-    get_bera_boostees,
-    get_bera_boosts,
-    get_bera_queued_boost,
-    get_bera_unboosted,
-)
+from bera import add_bgt_reads, get_bera_bgt_figures
+from collector import ScrapeCollector
+from config_watcher import ConfigWatcher
 from cosmos import (
-    get_cosmos_registry,
+    DenomResolver,
+    async_get_coins_balances,
+    async_get_delegations,
+    async_get_rewards,
+    async_get_unbonding_delegations,
+    COSMOS_REGISTRY_URLS,
+    get_coins_balances,
     get_delegations,
-    get_maincoin_balance,
+    get_latest_height,
     get_rewards,
     get_unbonding_delegations,
 )
 from dotenv import load_dotenv
-from ethereum import get_ethereum_balance, get_evm_chains_data
-from metrics_enum import MetricsAccountInfo, NetworkType, TokenType
-from prometheus_client import Counter, Gauge, start_http_server
-from solana_wallet import get_solana_balance
-from substrate import get_substrate_account_balance
-from utils import configure_logging, read_config_file
+from ethereum import (
+    EVM_CHAINS_URL,
+    TokenMetadataCache,
+    get_block_number,
+    get_blocks_touched_addresses,
+    get_chain_id,
+    get_chain_symbol,
+    get_erc20_balance,
+    get_ethereum_balances_batch,
+    get_web3,
+)
+from endpoints import Endpoints, endpoint_urls
+from executor import FetchExecutor, endpoint_host
+from head_gate import HeadGate
+from metrics_enum import MetricsAccountInfo, MetricsUrlStatus, NetworkType, TokenType
+from multicall import MULTICALL3_ADDRESS, Multicall
+from profiler import start_profiling_server
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram, start_http_server
+from registry_cache import RegistryCache
+from registry_index import RegistryIndex, index_cosmos_registry, index_evm_chains
+from resilience import CircuitBreakers, CircuitState
+from scheduler import NetworkScheduler
+from solana_wallet import (
+    LAMPORTS_PER_SOL,
+    get_solana_balances,
+    get_solana_slot,
+    get_solana_token_balances,
+)
+from subscriptions import EvmSubscription, SolanaAccountSubscription
+from substrate import get_substrate_balances, get_substrate_block_number
+from telemetry import call_context, with_call_context
+from utils import (
+    AsyncHttpClient,
+    configure_logging,
+    read_config_file,
+    set_request_timeout,
+)
+
+# network types whose native balances are fetched for all wallets at once
+NETWORK_BALANCE_TYPES = (
+    NetworkType.EVM.value,
+    NetworkType.BERA.value,
+    NetworkType.SUBSTRATE.value,
+    NetworkType.SOLANA.value,
+)
+
+# account_info type of every BGT read done through multicall
+BGT_METRICS = {
+    "boosts": MetricsAccountInfo.BOOSTS,
+    "boostees": MetricsAccountInfo.VALIDATOR_BOOSTEES,
+    "unboostedBalanceOf": MetricsAccountInfo.UNBOOSTED,
+    "queuedBoost": MetricsAccountInfo.QUEUED_BOOST,
+}
 
 
 class AppMetrics:
@@ -32,119 +87,816 @@ class AppMetrics:
     application metrics into Prometheus metrics.
     """
 
-    def __init__(self, polling_interval_seconds=60, walletconfig=False, logging=False):
+    def __init__(
+        self,
+        polling_interval_seconds=60,
+        walletconfig=False,
+        logging=False,
+        fetch_workers=16,
+        max_in_flight_per_host=4,
+        cosmos_async_http=True,
+        evm_batch_size=100,
+        token_metadata_file=None,
+        registry_cache_dir=".registry_cache",
+        registry_ttl_seconds=86400,
+        polling_jitter=0.1,
+        collection_mode="poll",
+        scrape_timeout=8,
+        min_height_delta=1,
+        max_staleness_seconds=3600,
+        reconcile_interval_seconds=900,
+        fetch_deadline_seconds=None,
+        breaker_failure_threshold=5,
+        breaker_reset_seconds=30,
+        hedge_requests=False,
+        request_timeout=10,
+        config_path=None,
+        config_reload_interval_seconds=5,
+    ):
         self.polling_interval_seconds = polling_interval_seconds
+        self.polling_jitter = polling_jitter
+        self.schedulers = {}
+        self.collection_mode = collection_mode
+        self.scrape_timeout = scrape_timeout
+        self.min_height_delta = min_height_delta
+        self.max_staleness_seconds = max_staleness_seconds
+        self.head_gate = HeadGate()
+        self.reconcile_interval_seconds = reconcile_interval_seconds
+        self.subscriptions = {}
+        self.fetch_deadline_seconds = fetch_deadline_seconds
+        self.collector = None
+        self.config_watcher = None
+        if config_path and config_reload_interval_seconds > 0:
+            self.config_watcher = ConfigWatcher(
+                config_path,
+                self.reload_config,
+                logging,
+                interval=config_reload_interval_seconds,
+            )
+        self._reload_lock = threading.Lock()
 
         self.logging = logging
         self.logging.info("Init the Appmetrics class")
         self.walletconfig = walletconfig
+        # label sets of the account_info series of every configured wallet
+        self._series_lock = threading.Lock()
+        self._series = self._wallet_series(walletconfig)
+        self.evm_batch_size = evm_batch_size
+        self.token_metadata = TokenMetadataCache(token_metadata_file)
+        self.denom_resolver = DenomResolver()
+        set_request_timeout(request_timeout)
+        # endpoints failing repeatedly are skipped until they recover
+        self.breakers = CircuitBreakers(
+            failure_threshold=breaker_failure_threshold,
+            reset_timeout=breaker_reset_seconds,
+            on_state_change=self._set_breaker_state,
+        )
+        self.executor = FetchExecutor(
+            max_workers=fetch_workers, max_in_flight_per_host=max_in_flight_per_host
+        )
+        self.endpoints = Endpoints(self.breakers, self.executor)
+        self.hedge_requests = hedge_requests
+        # cosmos REST traffic runs on a single event loop with pooled connections
+        self.async_http = None
+        if cosmos_async_http:
+            self.async_http = AsyncHttpClient(limit_per_host=max_in_flight_per_host)
 
         # all metrics are defined below
+        # in scrape mode account_info is only exposed through the collector
         self.account_info = Gauge(
             "account_info",
             "account information",
             ["address", "name", "network", "type", "token", "token_type"],
+            registry=None if collection_mode == "scrape" else REGISTRY,
         )
         self.rpc_call_status_counter = Counter(
             "rpc_call_status",
             "Count the number of success or failed http call for a given url",
             ["url", "status"],
         )
-        self.cosmos_registry = get_cosmos_registry(
-            "mainnet", self.rpc_call_status_counter
+        self.fetch_interval_overrun = Counter(
+            "fetch_interval_overrun",
+            "Count the refresh cycles of a network that overran its polling interval",
+            ["network"],
         )
-        self.cosmos_testnet_registry = get_cosmos_registry(
-            "testnet", self.rpc_call_status_counter
+        self.fetch_cycle_duration = Histogram(
+            "fetch_cycle_duration_seconds",
+            "Duration of the full refreshes of a network",
+            ["network"],
         )
-        self.chains_evm = get_evm_chains_data(self.rpc_call_status_counter)
+        self.account_info_last_update = Gauge(
+            "account_info_last_update_timestamp_seconds",
+            "Time of the last successful update of an account_info type of a wallet",
+            ["network", "address", "name", "type"],
+        )
+        self.circuit_breaker_state = Gauge(
+            "circuit_breaker_state",
+            "State of the circuit breaker of an endpoint host, 0 closed, 1 half-open, 2 open",
+            ["host"],
+        )
+        self.account_info_height = Gauge(
+            "account_info_height",
+            "Head height at which the account_info of a network was refreshed",
+            ["network"],
+        )
+
+        # registries are served from disk and refreshed in the background,
+        # only the ones needed by the configured network types are loaded
+        self.registry_index = RegistryIndex()
+        self.registries = RegistryCache(
+            cache_dir=registry_cache_dir,
+            ttl=registry_ttl_seconds,
+            rpc_call_status_counter=self.rpc_call_status_counter,
+            logging=self.logging,
+        )
+        self._register_registries(walletconfig)
+        self.registries.start()
 
         logging.debug(walletconfig)
 
+    def _register_registries(self, walletconfig):
+        """Load the registries needed by the network types of a config"""
+        network_types = {network["type"] for network in walletconfig["networks"]}
+        registries = []
+        if NetworkType.COSMOS.value in network_types:
+            for registry in ("mainnet", "testnet"):
+                registries.append(
+                    (
+                        f"cosmos_{registry}",
+                        COSMOS_REGISTRY_URLS[registry],
+                        index_cosmos_registry,
+                    )
+                )
+        if network_types & {NetworkType.EVM.value, NetworkType.BERA.value}:
+            registries.append(("evm_chains", EVM_CHAINS_URL, index_evm_chains))
+        for name, url, build_index in registries:
+            if name not in self.registries:
+                self._register_registry(name, url, build_index)
+
+    def _register_registry(self, name, url, build_index):
+        """Load a registry and keep only its compact index in memory"""
+        self.registries.register(
+            name,
+            url,
+            lambda data: self.registry_index.update(name, build_index(data)),
+        )
+
+    def _subscribed(self, network):
+        return "ws" in network and network["type"] in (
+            NetworkType.EVM.value,
+            NetworkType.BERA.value,
+            NetworkType.SOLANA.value,
+        )
+
+    def _streams_balances(self, network):
+        """Whether the native balances of a network come from its subscription"""
+        return network["type"] == NetworkType.SOLANA.value and "ws" in network
+
+    def _reconcile_interval(self, network):
+        return network.get("reconcile_interval", self.reconcile_interval_seconds)
+
+    def _refresh_interval(self, network):
+        """Return the time between 2 full refreshes of a network"""
+        if self._subscribed(network) and not (
+            self._streams_balances(network) and network.get("spl_tokens", True)
+        ):
+            # subscribed networks are only polled to reconcile missed events
+            return self._reconcile_interval(network)
+        # only the SOL balances are streamed, the SPL tokens are still polled
+        return network.get("polling_interval", self.polling_interval_seconds)
+
+    def _network_subscription(self, network):
+        return EvmSubscription(
+            name=network["name"],
+            ws_url=network["ws"],
+            addresses=[wallet["address"] for wallet in network["wallets"]],
+            token_addresses={
+                wallet["contract_address"]
+                for wallet in network["wallets"]
+                if "contract_address" in wallet
+            },
+            on_head=lambda block_numbers, token_touched: self._run_job(
+                self.fetch_touched_wallets,
+                network=network,
+                block_numbers=block_numbers,
+                token_touched=token_touched,
+            ),
+            on_resync=lambda: self._fetch_networks([network], self._deadline(network)),
+            logging=self.logging,
+        )
+
+    def _solana_subscription(self, ws_url, networks):
+        """Stream the SOL balance of every wallet of the networks of a rpc"""
+        wallets = defaultdict(list)
+        for network in networks:
+            for wallet in network["wallets"]:
+                wallets[wallet["address"]].append((network["name"], wallet))
+
+        def on_balance(address, lamports):
+            for network_name, wallet in wallets[address]:
+                self._set_balance_metric(
+                    network_name,
+                    wallet,
+                    lamports / LAMPORTS_PER_SOL,
+                    "SOL",
+                    TokenType.NATIVE.value,
+                )
+
+        def on_resync():
+            for network in networks:
+                self._run_job(
+                    self._on_endpoints, job=self.fetch_network_balances, network=network
+                )
+
+        return SolanaAccountSubscription(
+            name=endpoint_host(ws_url),
+            ws_url=ws_url,
+            addresses=list(wallets),
+            on_balance=on_balance,
+            on_resync=on_resync,
+            logging=self.logging,
+            resync_interval=min(
+                self._reconcile_interval(network) for network in networks
+            ),
+        )
+
+    def _subscription_networks(self):
+        """Return the networks followed by every subscription
+
+        Solana networks sharing a rpc share a single websocket, keyed by its
+        url, the other subscriptions are keyed by network name.
+        """
+        subscriptions = defaultdict(list)
+        for network in self.walletconfig["networks"]:
+            if not self._subscribed(network):
+                continue
+            if network["type"] == NetworkType.SOLANA.value:
+                subscriptions[network["ws"]].append(network)
+            else:
+                subscriptions[network["name"]].append(network)
+        return subscriptions
+
+    def _start_subscription(self, key, networks):
+        if networks[0]["type"] == NetworkType.SOLANA.value:
+            subscription = self._solana_subscription(key, networks)
+        else:
+            subscription = self._network_subscription(networks[0])
+        subscription.start()
+        self.subscriptions[key] = (subscription, networks)
+
+    def start_subscriptions(self):
+        """Follow the events of the networks configured with a websocket"""
+        for key, networks in self._subscription_networks().items():
+            self._start_subscription(key, networks)
+
+    def _update_subscriptions(self):
+        """Restart the subscriptions whose networks changed"""
+        wanted = self._subscription_networks()
+        for key in set(self.subscriptions) | set(wanted):
+            running = self.subscriptions.get(key)
+            if running is not None and running[1] == wanted.get(key):
+                continue
+            if running is not None:
+                running[0].stop()
+                del self.subscriptions[key]
+            if key in wanted:
+                self._start_subscription(key, wanted[key])
+
+    def fetch_touched_wallets(self, network, block_numbers, token_touched):
+        """Refresh the wallets of a network touched by some blocks
+
+        Args:
+          block_numbers: blocks whose transactions are checked
+          token_touched: addresses with an ERC-20 Transfer in those blocks
+        """
+        with call_context(method="blocks", network_type=network["type"]):
+            touched = set(token_touched) | self.endpoints.call(
+                endpoint_urls(network, "api"),
+                lambda api: get_blocks_touched_addresses(
+                    api, block_numbers, self.rpc_call_status_counter
+                ),
+                hedge=self._hedge(network),
+            )
+        wallets = [
+            wallet
+            for wallet in network["wallets"]
+            if wallet["address"].lower() in touched
+        ]
+        if wallets:
+            self.logging.info(
+                f"{len(wallets)} {network['name']} wallet(s) touched "
+                f"up to block {block_numbers[-1]}"
+            )
+            self._fetch_networks(
+                [dict(network, wallets=wallets)], self._deadline(network)
+            )
+
+    def _network_scheduler(self, network):
+        overrun_counter = self.fetch_interval_overrun.labels(network=network["name"])
+        return NetworkScheduler(
+            name=network["name"],
+            interval=self._refresh_interval(network),
+            job=lambda: self.fetch_network(network),
+            on_overrun=lambda missed: overrun_counter.inc(),
+            logging=self.logging,
+            jitter=self.polling_jitter,
+        )
+
+    def run_scrape_mode(self):
+        """Refresh the metrics on scrape instead of polling
+
+        The polling interval of a network is the maximum age of its cached
+        values.
+        """
+
+        self.collector = ScrapeCollector(
+            networks=self._collected_networks(),
+            fetch_network=self.fetch_network,
+            metrics=[self.account_info],
+            logging=self.logging,
+            scrape_timeout=self.scrape_timeout,
+        )
+        REGISTRY.register(self.collector)
+        self.start_subscriptions()
+        self._watch_config()
+        # everything now runs on the scrapes of the http server threads
+        threading.Event().wait()
+
     def run_metrics_loop(self):
-        """Metrics fetching loop"""
+        """Metrics fetching loop
+
+        Every network is polled by its own scheduler, so a slow endpoint
+        only delays the wallets of its own network.
+        """
 
-        while True:
-            self.fetch()
-            time.sleep(self.polling_interval_seconds)
+        self.schedulers = {
+            network["name"]: self._network_scheduler(network)
+            for network in self.walletconfig["networks"]
+        }
+        for scheduler in self.schedulers.values():
+            scheduler.start()
+        self.start_subscriptions()
+        self._watch_config()
+        # schedulers are started and stopped by the config reloads
+        threading.Event().wait()
+
+    def _collected_networks(self):
+        return [
+            (network, self._refresh_interval(network))
+            for network in self.walletconfig["networks"]
+        ]
+
+    def _watch_config(self):
+        if self.config_watcher is not None:
+            self.config_watcher.start(self.walletconfig)
+
+    def reload_config(self, walletconfig):
+        """Apply a new wallet config to the running exporter
+
+        Only the networks added, removed or changed are started or stopped,
+        the others keep running with their connections and caches. The
+        account_info series of the wallets no longer configured are removed.
+        """
+        with self._reload_lock:
+            previous = {
+                network["name"]: network for network in self.walletconfig["networks"]
+            }
+            current = {network["name"]: network for network in walletconfig["networks"]}
+            removed = set(previous) - set(current)
+            added = set(current) - set(previous)
+            changed = {
+                name
+                for name in set(previous) & set(current)
+                if previous[name] != current[name]
+            }
+            if not (removed or added or changed):
+                self.logging.info("Config unchanged")
+                return
+            self.logging.info(
+                f"Config reloaded: {len(added)} network(s) added, "
+                f"{len(removed)} removed, {len(changed)} changed"
+            )
+
+            # unchanged networks keep the objects their fetchers run with
+            walletconfig = dict(
+                walletconfig,
+                networks=[
+                    (
+                        previous.get(network["name"], network)
+                        if network["name"] not in changed
+                        else network
+                    )
+                    for network in walletconfig["networks"]
+                ],
+            )
+            self._register_registries(walletconfig)
+            self.walletconfig = walletconfig
+            self._evict_series(walletconfig)
+            for name in removed | changed:
+                # the wallets of a changed network are all read again
+                self.head_gate.forget(name)
+            for name in removed:
+                self.account_info_height.remove(name)
+
+            if self.collector is not None:
+                self.collector.update_networks(self._collected_networks())
+            else:
+                for name in removed | changed:
+                    self.schedulers.pop(name).stop()
+                for name in added | changed:
+                    scheduler = self._network_scheduler(current[name])
+                    scheduler.start()
+                    self.schedulers[name] = scheduler
+            self._update_subscriptions()
+
+    @staticmethod
+    def _wallet_key(network_name, wallet):
+        return network_name, wallet["address"], wallet["name"]
+
+    def _wallet_series(self, walletconfig, series=None):
+        """Return the series of the wallets of a config, kept from series"""
+        series = series or {}
+        return {
+            key: series.get(key, set())
+            for key in (
+                self._wallet_key(network["name"], wallet)
+                for network in walletconfig["networks"]
+                for wallet in network["wallets"]
+            )
+        }
+
+    def _evict_series(self, walletconfig):
+        """Remove the series of the wallets not configured anymore"""
+        with self._series_lock:
+            series = self._series
+            self._series = self._wallet_series(walletconfig, series)
+        evicted = 0
+        for key in set(series) - set(self._series):
+            network_name, address, name = key
+            for info_type in {labels[0] for labels in series[key]}:
+                self.account_info_last_update.remove(
+                    network_name, address, name, info_type
+                )
+            for info_type, token, token_type in series[key]:
+                self.account_info.remove(
+                    address, name, network_name, info_type, token, token_type
+                )
+                evicted += 1
+        if evicted:
+            self.logging.info(f"Removed {evicted} account_info series")
 
     def _set_balance_metric(self, network_name, wallet, balance, symbol, token_type):
         """Helper method to set balance metrics and log information."""
         self.logging.info(f"{wallet['address']} has {balance} {symbol}")
-        self.account_info.labels(
-            network=network_name,
-            address=wallet["address"],
-            name=wallet["name"],
-            token=symbol,
-            token_type=token_type,
-            type=MetricsAccountInfo.BALANCE.value,
-        ).set(balance)
+        self._set_account_info(
+            network_name,
+            wallet,
+            balance,
+            symbol,
+            token_type,
+            MetricsAccountInfo.BALANCE.value,
+        )
+
+    def _prune_balances(self, network_name, wallet, token_types, symbols):
+        """Remove the balance series of the tokens a wallet no longer holds
+
+        Args:
+          token_types: token types covered by a complete read of the balances
+          symbols: tokens of those types the read returned, the other ones
+            were left out, like zero bank balances or closed token accounts
+        """
+        with self._series_lock:
+            series = self._series.get(self._wallet_key(network_name, wallet))
+            if series is None:
+                return
+            gone = {
+                (info_type, token, token_type)
+                for info_type, token, token_type in series
+                if info_type == MetricsAccountInfo.BALANCE.value
+                and token_type in token_types
+                and token not in symbols
+            }
+            series -= gone
+            for info_type, token, token_type in gone:
+                self.account_info.remove(
+                    wallet["address"],
+                    wallet["name"],
+                    network_name,
+                    info_type,
+                    token,
+                    token_type,
+                )
+
+    def _set_account_info(
+        self, network_name, wallet, value, symbol, token_type, info_type
+    ):
+        """Helper method to set an account_info metric."""
+        with self._series_lock:
+            series = self._series.get(self._wallet_key(network_name, wallet))
+            if series is None:
+                # the wallet was removed from the config during its fetch
+                return
+            series.add((info_type, symbol, token_type))
+            self.account_info.labels(
+                network=network_name,
+                address=wallet["address"],
+                name=wallet["name"],
+                token=symbol,
+                token_type=token_type,
+                type=info_type,
+            ).set(value)
+            self.account_info_last_update.labels(
+                network=network_name,
+                address=wallet["address"],
+                name=wallet["name"],
+                type=info_type,
+            ).set_to_current_time()
 
     def fetch_balance(self, network, wallet, chain_registry):
         network_name = network["name"]
         network_type = network["type"]
-        balance = 0
 
         if network_type == NetworkType.COSMOS.value:
-            balance = float(
-                get_maincoin_balance(
-                    network["api"],
-                    wallet["address"],
-                    chain_registry["denom"],
-                    self.rpc_call_status_counter,
+            coins = self._cosmos_coins(
+                network,
+                chain_registry,
+                get_coins_balances(
+                    network["api"], wallet["address"], self.rpc_call_status_counter
+                ),
+            )
+            denoms = {}
+            for denom in coins:
+                if denom == chain_registry["denom"]:
+                    continue
+                try:
+                    denoms[denom] = self.denom_resolver.resolve(
+                        network["api"], denom, self.rpc_call_status_counter
+                    )
+                except Exception as e:
+                    denoms[denom] = e
+            self._set_cosmos_balances(network, wallet, chain_registry, coins, denoms)
+        elif (
+            network_type == NetworkType.EVM.value
+            or network_type == NetworkType.BERA.value
+        ):
+            # native balances are fetched per network in fetch_network_balances
+            if "contract_address" in wallet:
+                erc20_data = get_erc20_balance(
+                    apiprovider=network["api"],
+                    addr=wallet["address"],
+                    contract_address=wallet["contract_address"],
+                    rpc_call_status_counter=self.rpc_call_status_counter,
+                    token_metadata=self.token_metadata,
                 )
-            ) / (10 ** chain_registry["decimals"])
+                self._set_balance_metric(
+                    network_name,
+                    wallet,
+                    erc20_data["balance"],
+                    erc20_data["symbol"],
+                    TokenType.ERC_20.value,
+                )
+
+    def _cosmos_coins(self, network, chain_registry, coins):
+        """Return the bank balances to export, the main denom always first"""
+        main_denom = chain_registry["denom"]
+        if not network.get("all_denoms", True):
+            return {main_denom: coins.get(main_denom, 0)}
+        return {main_denom: 0, **coins}
+
+    def _set_cosmos_balances(self, network, wallet, chain_registry, coins, denoms):
+        """Helper method to set the balance of every denom of a cosmos wallet
+
+        The bank balances leave out the denoms a wallet no longer holds, their
+        series are removed unless a denom could not be resolved this time.
+
+        Args:
+          coins: dict of denom to amount
+          denoms: dict of denom to symbol and exponent, or to the resolution error
+        """
+        symbols = set()
+        resolved = True
+        for denom, amount in coins.items():
+            if denom == chain_registry["denom"]:
+                symbol = chain_registry["symbol"]
+                exponent = chain_registry["decimals"]
+                token_type = TokenType.NATIVE.value
+            else:
+                info = denoms.get(denom)
+                if info is None or isinstance(info, Exception):
+                    self.logging.error(
+                        f"Cannot resolve denom {denom} of {wallet['address']}: {info}"
+                    )
+                    resolved = False
+                    continue
+                symbol = info["symbol"]
+                exponent = info["exponent"]
+                if denom.startswith("ibc/"):
+                    token_type = TokenType.IBC.value
+                else:
+                    token_type = TokenType.NATIVE.value
             self._set_balance_metric(
-                network_name,
+                network["name"],
                 wallet,
-                balance,
-                chain_registry["symbol"],
-                TokenType.NATIVE.value,
+                float(amount) / (10**exponent),
+                symbol,
+                token_type,
             )
-        elif (
+            symbols.add(symbol)
+        if resolved:
+            self._prune_balances(
+                network["name"],
+                wallet,
+                {TokenType.NATIVE.value, TokenType.IBC.value},
+                symbols,
+            )
+
+    def fetch_network_balances(self, network):
+        """Fetch the native balance of every wallet of a network at once"""
+        network_type = network["type"]
+
+        if (
             network_type == NetworkType.EVM.value
             or network_type == NetworkType.BERA.value
         ):
-            balances_data = get_ethereum_balance(
+            block_number, balances = get_ethereum_balances_batch(
                 apiprovider=network["api"],
-                wallet=wallet,
+                addresses=[wallet["address"] for wallet in network["wallets"]],
                 rpc_call_status_counter=self.rpc_call_status_counter,
-                chains_evm=self.chains_evm,
-            )
-            for balance_data in balances_data:
-                balance = balance_data["balance"]
-                symbol = balance_data["symbol"]
-                self.logging.info(f"{wallet['address']} has {balance} {symbol}")
-                self.account_info.labels(
-                    network=network_name,
-                    address=wallet["address"],
-                    name=wallet["name"],
-                    token_type=balance_data["token_type"],
-                    token=symbol,
-                    type=MetricsAccountInfo.BALANCE.value,
-                ).set(balance)
+                batch_size=network.get("batch_size", self.evm_batch_size),
+            )
+            symbol = get_chain_symbol(
+                chain_id=get_chain_id(network["api"]),
+                chain_data=self.registry_index.registry("evm_chains"),
+            )
+            self.logging.info(
+                f"Fetched {len(balances)} {network['name']} balances at block {block_number}"
+            )
+            self._set_network_balances(network, balances, symbol)
         elif network_type == NetworkType.SUBSTRATE.value:
-            substrate_info = get_substrate_account_balance(
+            substrate_info = get_substrate_balances(
                 node_url=network["api"],
-                address=wallet["address"],
+                addresses=[wallet["address"] for wallet in network["wallets"]],
                 rpc_call_status_counter=self.rpc_call_status_counter,
             )
-            balance = substrate_info.get("balance") / 10 ** substrate_info.get(
-                "decimals"
+            decimals = substrate_info["decimals"]
+            balances = {
+                address: balance / 10**decimals
+                for address, balance in substrate_info["balances"].items()
+            }
+            self._set_network_balances(network, balances, substrate_info["symbol"])
+        elif network_type == NetworkType.SOLANA.value:
+            balances = get_solana_balances(
+                rpc_url=network["rpc"],
+                addresses=[wallet["address"] for wallet in network["wallets"]],
+                rpc_call_status_counter=self.rpc_call_status_counter,
             )
-            symbol = substrate_info.get("symbol")
+            self._set_network_balances(network, balances, "SOL")
+
+    def _set_network_balances(self, network, balances, symbol):
+        """Helper method to set the native balance of every wallet of a network
+
+        Args:
+          balances: dict of address to balance, failed addresses are missing
+        """
+        for wallet in network["wallets"]:
+            if wallet["address"] not in balances:
+                self.logging.error(
+                    f"{network['name']} balance failed for {wallet['address']}"
+                )
+                continue
             self._set_balance_metric(
-                network_name, wallet, balance, symbol, TokenType.NATIVE.value
+                network["name"],
+                wallet,
+                balances[wallet["address"]],
+                symbol,
+                TokenType.NATIVE.value,
             )
-        elif network_type == NetworkType.SOLANA.value:
-            solana_info = get_solana_balance(
+
+    def fetch_network_contract_reads(self, network):
+        """
+        Fetch the ERC-20 and BGT figures of every wallet of a network with
+        a few Multicall3 aggregate3 calls.
+        """
+        network_name = network["name"]
+        multicall = Multicall(
+            get_web3(network["api"]),
+            address=network.get("multicall_address", MULTICALL3_ADDRESS),
+        )
+
+        chain_id = None
+        if any("contract_address" in wallet for wallet in network["wallets"]):
+            chain_id = get_chain_id(network["api"])
+        tokens = {}
+        erc20_reads = []
+        bgt_reads = []
+        for wallet in network["wallets"]:
+            # the reads are only encoded here, a malformed address or
+            # contract_address only fails the reads of its own wallet
+            try:
+                if "contract_address" in wallet:
+                    contract_address = wallet["contract_address"]
+                    if contract_address not in tokens:
+                        # decimals and symbol are only read for unknown tokens
+                        tokens[contract_address] = self.token_metadata.get(
+                            chain_id, contract_address
+                        ) or (
+                            multicall.add(contract_address, "decimals()", [], "uint8"),
+                            multicall.add(contract_address, "symbol()", [], "string"),
+                        )
+                    erc20_reads.append(
+                        (
+                            wallet,
+                            contract_address,
+                            multicall.add(
+                                contract_address,
+                                "balanceOf(address)",
+                                [wallet["address"]],
+                            ),
+                        )
+                    )
+                if network["type"] == NetworkType.BERA.value:
+                    bgt_reads.append(
+                        (
+                            wallet,
+                            add_bgt_reads(
+                                multicall, network["bgt_address"], wallet["address"]
+                            ),
+                        )
+                    )
+            except Exception as e:
+                self.logging.error(
+                    f"Cannot read the contracts of {wallet['address']}: {e}"
+                )
+
+        if not len(multicall):
+            return
+        try:
+            results = multicall.execute()
+        except Exception:
+            self.rpc_call_status_counter.labels(
+                url=network["api"], status=MetricsUrlStatus.FAILED.value
+            ).inc()
+            raise
+        self.rpc_call_status_counter.labels(
+            url=network["api"], status=MetricsUrlStatus.SUCCESS.value
+        ).inc()
+
+        for contract_address, metadata in tokens.items():
+            if isinstance(metadata, tuple):
+                decimals, symbol = (results[index] for index in metadata)
+                if decimals is None:
+                    tokens[contract_address] = None
+                    continue
+                if symbol is None:
+                    symbol = "Unknown"
+                else:
+                    self.token_metadata.set(
+                        chain_id, contract_address, decimals, symbol
+                    )
+                tokens[contract_address] = {"decimals": decimals, "symbol": symbol}
+
+        for wallet, contract_address, index in erc20_reads:
+            metadata = tokens[contract_address]
+            if results[index] is None or metadata is None:
+                self.logging.error(
+                    f"erc20 {contract_address} balance failed for {wallet['address']}"
+                )
+                continue
+            self._set_balance_metric(
+                network_name,
+                wallet,
+                results[index] / (10 ** metadata["decimals"]),
+                metadata["symbol"],
+                TokenType.ERC_20.value,
+            )
+
+        for wallet, indexes in bgt_reads:
+            self._set_bgt_metrics(
+                network_name,
+                wallet,
+                {name: results[index] for name, index in indexes.items()},
+            )
+
+    def fetch_spl_token_balances(self, network, wallet, chain_registry=None):
+        network_type = network["type"]
+
+        if network_type == NetworkType.SOLANA.value:
+            token_balances = get_solana_token_balances(
                 rpc_url=network["rpc"],
                 address=wallet["address"],
                 rpc_call_status_counter=self.rpc_call_status_counter,
             )
-            balance = solana_info.get("balance")
-            symbol = solana_info.get("symbol")
-            self._set_balance_metric(
-                network_name, wallet, balance, symbol, TokenType.NATIVE.value
+            # SPL tokens have no on chain symbol, the mint address is used instead
+            for mint, token_balance in token_balances.items():
+                self._set_balance_metric(
+                    network["name"],
+                    wallet,
+                    token_balance["balance"],
+                    mint,
+                    TokenType.SPL.value,
+                )
+            self._prune_balances(
+                network["name"], wallet, {TokenType.SPL.value}, set(token_balances)
             )
 
     def fetch_delegations(self, network, wallet, chain_registry):
@@ -161,37 +913,47 @@ class AppMetrics:
                 )
             ) / (10 ** chain_registry["decimals"])
             self.logging.info(f"{wallet['address']} has {delegations} delegations")
-            self.account_info.labels(
-                network=network_name,
-                address=wallet["address"],
-                name=wallet["name"],
-                token=chain_registry["symbol"],
-                token_type=TokenType.NATIVE.value,
-                type=MetricsAccountInfo.DELEGATIONS.value,
-            ).set(delegations)
+            self._set_account_info(
+                network_name,
+                wallet,
+                delegations,
+                chain_registry["symbol"],
+                TokenType.NATIVE.value,
+                MetricsAccountInfo.DELEGATIONS.value,
+            )
 
-    def fetch_boosts(self, network, wallet):
-        network_name = network["name"]
+    def fetch_bgt_figures(self, network, wallet, chain_registry=None):
         network_type = network["type"]
 
         if network_type == NetworkType.BERA.value:
-            bera_boosts = (
-                get_bera_boosts(
-                    bgt_address=network["bgt_address"],
-                    wallet=wallet["address"],
-                    api=network["api"],
-                )
-                / 10**18
+            figures = get_bera_bgt_figures(
+                bgt_address=network["bgt_address"],
+                wallet=wallet["address"],
+                api=network["api"],
+            )
+            self._set_bgt_metrics(network["name"], wallet, figures)
+
+    def _set_bgt_metrics(self, network_name, wallet, figures):
+        """Helper method to set the BGT metrics of a wallet
+
+        Args:
+          figures: dict of BGT function name to raw result, None if it failed
+        """
+        for name, raw_value in figures.items():
+            info_type = BGT_METRICS[name]
+            if raw_value is None:
+                self.logging.error(f"bgt {name} failed for {wallet['address']}")
+                continue
+            value = raw_value / 10**18
+            self.logging.info(f"{wallet['address']} has {value} bgt {info_type.value}")
+            self._set_account_info(
+                network_name,
+                wallet,
+                value,
+                "BGT",
+                TokenType.ERC_20.value,
+                info_type.value,
             )
-            self.logging.info(f"{wallet['address']} has {bera_boosts} bgt boosts")
-            self.account_info.labels(
-                network=network_name,
-                address=wallet["address"],
-                name=wallet["name"],
-                token="BGT",
-                token_type=TokenType.ERC_20.value,
-                type=MetricsAccountInfo.BOOSTS.value,
-            ).set(bera_boosts)
 
     def fetch_unbounding_delegations(self, network, wallet, chain_registry):
         network_name = network["name"]
@@ -208,14 +970,14 @@ class AppMetrics:
             self.logging.info(
                 f"{wallet['address']} has {unbounding_delegations} unbounding delegations"
             )
-            self.account_info.labels(
-                network=network_name,
-                address=wallet["address"],
-                name=wallet["name"],
-                token=chain_registry["symbol"],
-                token_type=TokenType.NATIVE.value,
-                type=MetricsAccountInfo.UNBOUNDING_DELEGATIONS.value,
-            ).set(unbounding_delegations)
+            self._set_account_info(
+                network_name,
+                wallet,
+                unbounding_delegations,
+                chain_registry["symbol"],
+                TokenType.NATIVE.value,
+                MetricsAccountInfo.UNBOUNDING_DELEGATIONS.value,
+            )
 
     def fetch_rewards(self, network, wallet, chain_registry):
         network_name = network["name"]
@@ -231,140 +993,403 @@ class AppMetrics:
                 )
             ) / (10 ** chain_registry["decimals"])
             self.logging.info(f"{wallet['address']} has {rewards} rewards")
-            self.account_info.labels(
-                network=network_name,
-                address=wallet["address"],
-                name=wallet["name"],
-                token=chain_registry["symbol"],
-                token_type=TokenType.NATIVE.value,
-                type=MetricsAccountInfo.REWARDS.value,
-            ).set(rewards)
+            self._set_account_info(
+                network_name,
+                wallet,
+                rewards,
+                chain_registry["symbol"],
+                TokenType.NATIVE.value,
+                MetricsAccountInfo.REWARDS.value,
+            )
 
-    def fetch_boostees(self, network, wallet):
-        network_name = network["name"]
-        network_type = network["type"]
+    def _use_multicall(self, network):
+        """Whether the contract reads of a network go through Multicall3"""
+        return network["type"] in (
+            NetworkType.EVM.value,
+            NetworkType.BERA.value,
+        ) and network.get("multicall", True)
 
+    def _wallet_jobs(self, network):
+        """Return the fetch methods that apply to the wallets of a network"""
+        network_type = network["type"]
+        if self._use_multicall(network):
+            # contract reads are done per network and native balances are batched
+            return ()
+        if network_type == NetworkType.COSMOS.value:
+            return (
+                self.fetch_balance,
+                self.fetch_delegations,
+                self.fetch_unbounding_delegations,
+                self.fetch_rewards,
+            )
         if network_type == NetworkType.BERA.value:
-            bera_boostees = (
-                get_bera_boostees(
-                    bgt_address=network["bgt_address"],
-                    wallet=wallet["address"],
-                    api=network["api"],
+            return (self.fetch_balance, self.fetch_bgt_figures)
+        if network_type == NetworkType.SOLANA.value:
+            # native balances are fetched per network
+            if network.get("spl_tokens", True):
+                return (self.fetch_spl_token_balances,)
+            return ()
+        if network_type == NetworkType.SUBSTRATE.value:
+            # balances are fetched per network
+            return ()
+        return (self.fetch_balance,)
+
+    def _log_job_failure(self, job, kwargs, error):
+        # jobs run on the network endpoints are reported by their name
+        job = kwargs.get("job", job)
+        if "wallet" in kwargs:
+            target = kwargs["wallet"]["address"]
+        else:
+            target = kwargs["network"]["name"]
+        self.logging.error(f"{job.__name__} failed for {target}: {error}")
+
+    def _run_job(self, fn, **kwargs):
+        """Run a single fetch job, logging instead of raising on failure
+
+        Args:
+          fn: the job, or _on_endpoints with the job passed as job
+        """
+        try:
+            fn(**kwargs)
+        except Exception as e:
+            self._log_job_failure(fn, kwargs, e)
+
+    def _job_done(self, job, kwargs, future):
+        if not future.cancelled() and future.exception() is not None:
+            self._log_job_failure(job, kwargs, future.exception())
+
+    def _endpoint_key(self, network):
+        # solana wallets are fetched through the rpc endpoint
+        if network["type"] == NetworkType.SOLANA.value:
+            return "rpc"
+        return "api"
+
+    def _hedge(self, network):
+        return network.get("hedge", self.hedge_requests)
+
+    @staticmethod
+    def _job_method(job):
+        return job.__name__.replace("fetch_", "", 1)
+
+    def _on_endpoints(self, job, network, **kwargs):
+        """Run a fetch job on the best endpoint of a network, failing over
+
+        The job gets the network with its api or rpc set to the endpoint,
+        its calls are timed under the job name. Jobs set gauges, so they
+        are never hedged.
+        """
+        key = self._endpoint_key(network)
+        with call_context(method=self._job_method(job), network_type=network["type"]):
+            return self.endpoints.call(
+                endpoint_urls(network, key),
+                lambda url: job(network=dict(network, **{key: url}), **kwargs),
+            )
+
+    def _submit(self, job, **kwargs):
+        """Run a fetch job on the executor, failures being logged
+
+        The job is queued against the host of the best endpoint of its
+        network.
+        """
+        network = kwargs["network"]
+        urls = endpoint_urls(network, self._endpoint_key(network))
+        future = self.executor.submit(
+            self.endpoints.best(urls, self._job_method(job)),
+            self._on_endpoints,
+            job,
+            **kwargs,
+        )
+        future.add_done_callback(partial(self._job_done, job, kwargs))
+        return future
+
+    def _set_breaker_state(self, host, state):
+        if state != CircuitState.CLOSED:
+            self.logging.warning(f"Circuit breaker of {host} is {state.name}")
+        self.circuit_breaker_state.labels(host=host).set(state.value)
+
+    def _find_cosmos_registry(self, network):
+        # mainnet first, then check if it exists in testnet
+        return self.registry_index.get(
+            network["name"], "cosmos_mainnet", "cosmos_testnet"
+        )
+
+    async def async_fetch_cosmos_wallet(self, network, wallet, chain_registry):
+        """Fetch every cosmos metric of a wallet on the async http client
+
+        Returns:
+          True if every metric of the wallet was read
+        """
+        session = self.async_http.session
+        address = wallet["address"]
+        denom = chain_registry["denom"]
+        counter = self.rpc_call_status_counter
+
+        async def fetch_wallet(api):
+            results = await asyncio.gather(
+                with_call_context(
+                    async_get_coins_balances(session, api, address, counter),
+                    method="balance",
+                ),
+                with_call_context(
+                    async_get_delegations(session, api, address, denom, counter),
+                    method="delegations",
+                ),
+                with_call_context(
+                    async_get_unbonding_delegations(session, api, address, counter),
+                    method="unbounding_delegations",
+                ),
+                with_call_context(
+                    async_get_rewards(session, api, address, denom, counter),
+                    method="rewards",
+                ),
+                return_exceptions=True,
+            )
+            # the endpoint failed if nothing could be read
+            if all(isinstance(result, Exception) for result in results):
+                raise results[0]
+            return api, results
+
+        self.logging.info(f"Fetching {address}")
+        try:
+            with call_context(method="wallet"):
+                api, results = await self.endpoints.async_call(
+                    endpoint_urls(network, "api"),
+                    fetch_wallet,
+                    hedge=self._hedge(network),
                 )
-                / 10**18
+        except Exception as e:
+            self.logging.error(f"Fetching {address} failed: {e}")
+            return False
+
+        ok = True
+        if isinstance(results[0], Exception):
+            self.logging.error(f"balance failed for {address}: {results[0]}")
+            ok = False
+        else:
+            coins = self._cosmos_coins(network, chain_registry, results[0])
+            other_denoms = [d for d in coins if d != denom]
+            resolved = await asyncio.gather(
+                *[
+                    with_call_context(
+                        self.denom_resolver.async_resolve(session, api, d, counter),
+                        method="denom",
+                    )
+                    for d in other_denoms
+                ],
+                return_exceptions=True,
             )
-            self.logging.info(
-                f"{wallet['address']} has {bera_boostees} bera attributed to the validator for boosts"
+            self._set_cosmos_balances(
+                network,
+                wallet,
+                chain_registry,
+                coins,
+                dict(zip(other_denoms, resolved)),
             )
-            self.account_info.labels(
-                network=network_name,
-                address=wallet["address"],
-                name=wallet["name"],
-                token="BGT",
-                token_type=TokenType.ERC_20.value,
-                type=MetricsAccountInfo.VALIDATOR_BOOSTEES.value,
-            ).set(bera_boostees)
 
-    def fetch_unboosted(self, network, wallet):
-        network_name = network["name"]
-        network_type = network["type"]
+        info_types = (
+            MetricsAccountInfo.DELEGATIONS,
+            MetricsAccountInfo.UNBOUNDING_DELEGATIONS,
+            MetricsAccountInfo.REWARDS,
+        )
+        for info_type, result in zip(info_types, results[1:]):
+            if isinstance(result, Exception):
+                self.logging.error(f"{info_type.value} failed for {address}: {result}")
+                ok = False
+                continue
+            value = float(result) / (10 ** chain_registry["decimals"])
+            self.logging.info(f"{address} has {value} {info_type.value}")
+            self._set_account_info(
+                network["name"],
+                wallet,
+                value,
+                chain_registry["symbol"],
+                TokenType.NATIVE.value,
+                info_type.value,
+            )
+        return ok
 
-        if network_type == NetworkType.BERA.value:
-            bera_unboosted = (
-                get_bera_unboosted(
-                    bgt_address=network["bgt_address"],
-                    wallet=wallet["address"],
-                    api=network["api"],
+    async def async_fetch(self, cosmos_jobs):
+        """Fetch all the cosmos wallets concurrently on one event loop
+
+        Args:
+          cosmos_jobs: list of (network, chain_registry) tuples
+        Returns:
+          True if every wallet was fully read
+        """
+        results = await asyncio.gather(
+            *[
+                with_call_context(
+                    self.async_fetch_cosmos_wallet(network, wallet, chain_registry),
+                    network_type=network["type"],
                 )
-                / 10**18
-            )
-            self.logging.info(
-                f"{wallet['address']} has {bera_unboosted} bera unboosted"
+                for network, chain_registry in cosmos_jobs
+                for wallet in network["wallets"]
+            ]
+        )
+        return all(results)
+
+    def _submit_network(self, network, futures, cosmos_jobs):
+        """Queue every fetch job of a network
+
+        Jobs run on the executor are appended to futures, cosmos networks
+        fetched on the async http client are appended to cosmos_jobs.
+
+        Returns:
+          False if the jobs of the network cannot be run
+        """
+        self.logging.debug(network)
+
+        chain_registry = None
+        if network["type"] == NetworkType.COSMOS.value:
+            chain_registry = self._find_cosmos_registry(network)
+            if chain_registry is None:
+                self.logging.error(f"Cannot find chain {network} in cosmos registry")
+                return False
+            if self.async_http is not None:
+                cosmos_jobs.append((network, chain_registry))
+                return True
+
+        if network["type"] in NETWORK_BALANCE_TYPES and not self._streams_balances(
+            network
+        ):
+            # streamed balances are read again by their subscription
+            futures.append(self._submit(self.fetch_network_balances, network=network))
+        if self._use_multicall(network):
+            futures.append(
+                self._submit(self.fetch_network_contract_reads, network=network)
             )
-            self.account_info.labels(
-                network=network_name,
-                address=wallet["address"],
-                name=wallet["name"],
-                token="BGT",
-                token_type=TokenType.ERC_20.value,
-                type=MetricsAccountInfo.UNBOOSTED.value,
-            ).set(bera_unboosted)
 
-    def fetch_queued_boost(self, network, wallet):
-        network_name = network["name"]
-        network_type = network["type"]
+        for wallet in network["wallets"]:
+            self.logging.info(f"Fetching {wallet['address']}")
+            for job in self._wallet_jobs(network):
+                futures.append(
+                    self._submit(
+                        job,
+                        network=network,
+                        wallet=wallet,
+                        chain_registry=chain_registry,
+                    )
+                )
+        return True
 
-        if network_type == NetworkType.BERA.value:
-            bera_queued_boost = (
-                get_bera_queued_boost(
-                    bgt_address=network["bgt_address"],
-                    wallet=wallet["address"],
-                    api=network["api"],
+    def _deadline(self, network):
+        """Return the time budget of a refresh of a network"""
+        deadline = network.get("deadline", self.fetch_deadline_seconds)
+        if deadline is None:
+            deadline = self._refresh_interval(network)
+        return deadline
+
+    def _fetch_networks(self, networks, deadline):
+        """Run the fetch jobs of some networks for at most deadline seconds
+
+        Jobs not started by the deadline are cancelled, the ones in flight
+        are left to end on their request timeout.
+
+        Returns:
+          True if every job succeeded within the deadline
+        """
+        deadline_at = time.monotonic() + deadline
+        futures = []
+        cosmos_jobs = []
+        ok = True
+        for network in networks:
+            ok &= self._submit_network(network, futures, cosmos_jobs)
+
+        names = ", ".join(network["name"] for network in networks)
+        if cosmos_jobs:
+            try:
+                ok &= self.async_http.run(
+                    asyncio.wait_for(self.async_fetch(cosmos_jobs), deadline)
+                )
+            except asyncio.TimeoutError:
+                self.logging.error(
+                    f"Fetching {names} cosmos wallets missed its deadline"
                 )
-                / 10**18
+                ok = False
+        done, not_done = wait(futures, timeout=max(0, deadline_at - time.monotonic()))
+        if not_done:
+            for future in not_done:
+                future.cancel()
+            self.logging.error(
+                f"Fetching {names} missed its {deadline}s deadline, "
+                f"{len(not_done)} job(s) not done"
             )
-            self.logging.info(
-                f"{wallet['address']} has {bera_queued_boost} bera queued boost"
+            ok = False
+        return ok and all(
+            not future.cancelled() and future.exception() is None for future in done
+        )
+
+    def _head_height(self, network):
+        """Return the head height of a network with a single cheap call"""
+        network_type = network["type"]
+        if network_type == NetworkType.COSMOS.value:
+            key, get_height = "rpc", get_latest_height
+        elif network_type in (NetworkType.EVM.value, NetworkType.BERA.value):
+            key, get_height = "api", get_block_number
+        elif network_type == NetworkType.SOLANA.value:
+            key, get_height = "rpc", get_solana_slot
+        elif network_type == NetworkType.SUBSTRATE.value:
+            key, get_height = "api", get_substrate_block_number
+        else:
+            return None
+        with call_context(method="head", network_type=network_type):
+            return self.endpoints.call(
+                endpoint_urls(network, key),
+                lambda url: get_height(url, self.rpc_call_status_counter),
+                hedge=self._hedge(network),
             )
-            self.account_info.labels(
-                network=network_name,
-                address=wallet["address"],
-                name=wallet["name"],
-                token="BGT",
-                token_type=TokenType.ERC_20.value,
-                type=MetricsAccountInfo.QUEUED_BOOST.value,
-            ).set(bera_queued_boost)
+
+    def fetch_network(self, network):
+        """Refresh the metrics of a single network, run by its scheduler
+
+        The full refresh is skipped while the head of the network did not
+        move by min_height_delta, the previous values being kept.
+        """
+        network_name = network["name"]
+        min_height_delta = network.get("min_height_delta", self.min_height_delta)
+
+        height = None
+        if min_height_delta > 0:
+            try:
+                height = self._head_height(network)
+            except Exception as e:
+                self.logging.error(f"Cannot get the head of {network_name}: {e}")
+        if height is not None and not self.head_gate.should_refresh(
+            network_name,
+            height,
+            min_height_delta,
+            network.get("max_staleness", self.max_staleness_seconds),
+        ):
+            self.logging.info(f"{network_name} head is still {height}, skipping")
+            return
+
+        self.logging.info(f"Fetching {network_name} wallet balances")
+        with self.fetch_cycle_duration.labels(network=network_name).time():
+            ok = self._fetch_networks([network], self._deadline(network))
+        if not ok:
+            # retried at the next tick even if the head did not move
+            self.logging.warning(f"Fetching {network_name} was not complete")
+            return
+        # a network replaced by a config reload meanwhile is refreshed again
+        current = any(network is n for n in self.walletconfig["networks"])
+        if height is not None and current:
+            self.head_gate.record(network_name, height)
+            self.account_info_height.labels(network=network_name).set(height)
 
     def fetch(self):
         """
         Get metrics from application and refresh Prometheus metrics with
         new values.
+
+        Every (network, wallet, metric) job is fanned out to the executor,
+        so a cycle takes about as long as the slowest endpoint.
         """
 
         self.logging.info("Fetching wallet balances")
-
-        for network in self.walletconfig["networks"]:
-            self.logging.debug(network)
-
-            chain_registry = None
-            if network["type"] == NetworkType.COSMOS.value:
-                for chain in self.cosmos_registry:
-                    if chain["name"] == network["name"]:
-                        chain_registry = chain
-                        break
-                if chain_registry is None:
-                    # check if it exists in testnet
-                    for chain in self.cosmos_testnet_registry:
-                        if chain["name"] == network["name"]:
-                            chain_registry = chain
-                            break
-                    if chain_registry is None:
-                        self.logging.error(
-                            f"Cannot find chain {network} in cosmos registry"
-                        )
-                        continue
-
-            for wallet in network["wallets"]:
-                try:
-                    self.logging.info(f"Fetching {wallet['address']}")
-                    self.fetch_balance(
-                        network=network, wallet=wallet, chain_registry=chain_registry
-                    )
-                    self.fetch_delegations(
-                        network=network, wallet=wallet, chain_registry=chain_registry
-                    )
-                    self.fetch_unbounding_delegations(
-                        network=network, wallet=wallet, chain_registry=chain_registry
-                    )
-                    self.fetch_rewards(
-                        network=network, wallet=wallet, chain_registry=chain_registry
-                    )
-                    self.fetch_boosts(network=network, wallet=wallet)
-                    self.fetch_boostees(network=network, wallet=wallet)
-                    self.fetch_unboosted(network=network, wallet=wallet)
-                    self.fetch_queued_boost(network=network, wallet=wallet)
-                except Exception as e:
-                    self.logging.error(str(e))
+        networks = self.walletconfig["networks"]
+        self._fetch_networks(
+            networks, max(self._deadline(network) for network in networks)
+        )
 
 
 def argsparse():
@@ -427,6 +1452,31 @@ def main():
     load_dotenv()  # take environment variables from .env
     polling_interval_seconds = int(os.getenv("POLLING_INTERVAL_SECONDS", "60"))
     exporter_port = int(os.getenv("EXPORTER_PORT", "9877"))
+    fetch_workers = int(os.getenv("FETCH_WORKERS", "16"))
+    max_in_flight_per_host = int(os.getenv("MAX_IN_FLIGHT_PER_HOST", "4"))
+    cosmos_async_http = os.getenv("COSMOS_ASYNC_HTTP", "true").lower() == "true"
+    evm_batch_size = int(os.getenv("EVM_BATCH_SIZE", "100"))
+    registry_cache_dir = os.getenv("REGISTRY_CACHE_DIR", ".registry_cache")
+    registry_ttl_seconds = int(os.getenv("REGISTRY_TTL_SECONDS", "86400"))
+    token_metadata_file = os.getenv("TOKEN_METADATA_FILE", "token_metadata.json")
+    polling_jitter = float(os.getenv("POLLING_JITTER", "0.1"))
+    collection_mode = os.getenv("COLLECTION_MODE", "poll").lower()
+    scrape_timeout = float(os.getenv("SCRAPE_TIMEOUT_SECONDS", "8"))
+    min_height_delta = int(os.getenv("MIN_HEIGHT_DELTA", "1"))
+    max_staleness_seconds = int(os.getenv("MAX_STALENESS_SECONDS", "3600"))
+    reconcile_interval_seconds = int(os.getenv("RECONCILE_INTERVAL_SECONDS", "900"))
+    fetch_deadline_seconds = os.getenv("FETCH_DEADLINE_SECONDS")
+    if fetch_deadline_seconds is not None:
+        fetch_deadline_seconds = float(fetch_deadline_seconds)
+    breaker_failure_threshold = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+    breaker_reset_seconds = int(os.getenv("BREAKER_RESET_SECONDS", "30"))
+    hedge_requests = os.getenv("HEDGE_REQUESTS", "false").lower() == "true"
+    request_timeout = float(os.getenv("REQUEST_TIMEOUT_SECONDS", "10"))
+    config_reload_interval_seconds = float(
+        os.getenv("CONFIG_RELOAD_INTERVAL_SECONDS", "5")
+    )
+    profiling_port = os.getenv("PROFILING_PORT")
+    profiling_addr = os.getenv("PROFILING_ADDR", "127.0.0.1")
 
     log.info("Wallet Exporter started and now listening on port " + str(exporter_port))
 
@@ -434,9 +1484,34 @@ def main():
         polling_interval_seconds=polling_interval_seconds,
         walletconfig=walletconfigs,
         logging=log,
+        fetch_workers=fetch_workers,
+        max_in_flight_per_host=max_in_flight_per_host,
+        cosmos_async_http=cosmos_async_http,
+        evm_batch_size=evm_batch_size,
+        token_metadata_file=token_metadata_file,
+        registry_cache_dir=registry_cache_dir,
+        registry_ttl_seconds=registry_ttl_seconds,
+        polling_jitter=polling_jitter,
+        collection_mode=collection_mode,
+        scrape_timeout=scrape_timeout,
+        min_height_delta=min_height_delta,
+        max_staleness_seconds=max_staleness_seconds,
+        reconcile_interval_seconds=reconcile_interval_seconds,
+        fetch_deadline_seconds=fetch_deadline_seconds,
+        breaker_failure_threshold=breaker_failure_threshold,
+        breaker_reset_seconds=breaker_reset_seconds,
+        hedge_requests=hedge_requests,
+        request_timeout=request_timeout,
+        config_path=configfile,
+        config_reload_interval_seconds=config_reload_interval_seconds,
     )
     start_http_server(exporter_port)
-    app_metrics.run_metrics_loop()
+    if profiling_port:
+        start_profiling_server(int(profiling_port), profiling_addr)
+    if collection_mode == "scrape":
+        app_metrics.run_scrape_mode()
+    else:
+        app_metrics.run_metrics_loop()
 
 
 if __name__ == "__main__":
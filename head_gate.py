@@ -0,0 +1,39 @@
+"""Chain head gating of the network refreshes"""
+
+import threading
+import time
+
+
+class HeadGate:
+    """
+    Remember the head height at which every network was last refreshed.
+
+    Balances can only change with new blocks, so a network whose head did
+    not move by at least min_height_delta since its last refresh keeps
+    its cached values, until they are older than max_staleness.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._refreshed = {}
+
+    def should_refresh(self, name, height, min_height_delta, max_staleness):
+        """Tell if a network at a head height needs a full refresh"""
+        with self._lock:
+            refreshed = self._refreshed.get(name)
+        if refreshed is None:
+            return True
+        refreshed_height, refreshed_at = refreshed
+        if time.monotonic() - refreshed_at >= max_staleness:
+            return True
+        return height - refreshed_height >= min_height_delta
+
+    def record(self, name, height):
+        """Record the full refresh of a network at a head height"""
+        with self._lock:
+            self._refreshed[name] = (height, time.monotonic())
+
+    def forget(self, name):
+        """Drop the refresh record of a network, its next refresh is a full one"""
+        with self._lock:
+            self._refreshed.pop(name, None)
@@ -28,3 +28,5 @@ class NetworkType(Enum):
 class TokenType(Enum):
     ERC_20 = "erc20"
     NATIVE = "native"
+    SPL = "spl"
+    IBC = "ibc"
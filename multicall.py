@@ -0,0 +1,102 @@
+"""Multicall3 aggregation of contract reads"""
+
+from web3 import Web3
+
+# Multicall3 is deployed at the same address on most EVM chains
+MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
+MULTICALL_BATCH_SIZE = 500
+
+MULTICALL3_ABI = [
+    {
+        "inputs": [
+            {
+                "components": [
+                    {"name": "target", "type": "address"},
+                    {"name": "allowFailure", "type": "bool"},
+                    {"name": "callData", "type": "bytes"},
+                ],
+                "name": "calls",
+                "type": "tuple[]",
+            }
+        ],
+        "name": "aggregate3",
+        "outputs": [
+            {
+                "components": [
+                    {"name": "success", "type": "bool"},
+                    {"name": "returnData", "type": "bytes"},
+                ],
+                "name": "returnData",
+                "type": "tuple[]",
+            }
+        ],
+        "stateMutability": "payable",
+        "type": "function",
+    }
+]
+
+
+class Multicall:
+    """
+    Collect contract reads and run them as a few Multicall3 aggregate3
+    calls. Every read is allowed to fail on its own, a failed or
+    undecodable read gives None without affecting the others.
+    """
+
+    def __init__(
+        self, web3, address=MULTICALL3_ADDRESS, batch_size=MULTICALL_BATCH_SIZE
+    ):
+        self.web3 = web3
+        self.batch_size = batch_size
+        self.contract = web3.eth.contract(
+            address=Web3.to_checksum_address(address), abi=MULTICALL3_ABI
+        )
+        self._calls = []
+
+    def add(self, target, signature, args=(), output_type="uint256"):
+        """Queue a contract read
+
+        Args:
+          target: contract address
+          signature: function signature, for example "balanceOf(address)"
+          args: function arguments
+          output_type: abi type of the returned value
+        Returns:
+          The index of the read in the execute() results
+        """
+        arg_types = [
+            t for t in signature[signature.index("(") + 1 : -1].split(",") if t
+        ]
+        call_data = Web3.keccak(text=signature)[:4] + self.web3.codec.encode(
+            arg_types, list(args)
+        )
+        self._calls.append((Web3.to_checksum_address(target), call_data, output_type))
+        return len(self._calls) - 1
+
+    def __len__(self):
+        return len(self._calls)
+
+    def execute(self, block_identifier="latest"):
+        """Run every queued read
+
+        Returns:
+          The list of decoded values, None for the reads that failed
+        """
+        results = []
+        for start in range(0, len(self._calls), self.batch_size):
+            chunk = self._calls[start : start + self.batch_size]
+            responses = self.contract.functions.aggregate3(
+                [(target, True, call_data) for target, call_data, _ in chunk]
+            ).call(block_identifier=block_identifier)
+
+            for (_, _, output_type), (success, return_data) in zip(chunk, responses):
+                if not success:
+                    results.append(None)
+                    continue
+                try:
+                    results.append(
+                        self.web3.codec.decode([output_type], return_data)[0]
+                    )
+                except Exception:
+                    results.append(None)
+        return results
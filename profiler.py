@@ -0,0 +1,178 @@
+"""Debug endpoint profiling the exporter process"""
+
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# longest capture a request can ask for
+MAX_PROFILE_SECONDS = 300
+# frames kept per allocation traceback
+TRACEMALLOC_FRAMES = 25
+
+
+def _frame_name(code):
+    return (
+        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    )
+
+
+def _stack(thread_name, frame):
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    names.append(thread_name)
+    return ";".join(reversed(names))
+
+
+def _thread_cpu_time(ident):
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(ident))
+    except (AttributeError, OSError):
+        # thread gone, or no per thread cpu clock on this platform
+        return None
+
+
+def sample_stacks(seconds, interval=0.01, cpu=False):
+    """Sample the stacks of every thread for some seconds
+
+    Args:
+      interval: time between 2 samples
+      cpu: weight every sample by the cpu time the thread used since the
+        previous one, in microseconds, instead of counting it
+
+    Returns:
+      Counter of folded stacks, the thread name being the root frame
+    """
+    own_ident = threading.get_ident()
+    stacks = Counter()
+    cpu_times = {}
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            weight = 1
+            if cpu:
+                cpu_time = _thread_cpu_time(ident)
+                previous = cpu_times.get(ident)
+                cpu_times[ident] = cpu_time
+                if cpu_time is None or previous is None:
+                    continue
+                weight = int((cpu_time - previous) * 1e6)
+                if weight <= 0:
+                    continue
+            stacks[_stack(names.get(ident, str(ident)), frame)] += weight
+        time.sleep(interval)
+    return stacks
+
+
+def allocation_stacks(seconds, top=50):
+    """Trace the memory allocations for some seconds
+
+    Tracing is started for the capture unless it already runs, so only the
+    blocks allocated meanwhile and still alive are seen.
+
+    Returns:
+      Counter of folded allocation stacks weighted by their size in bytes,
+      limited to the top largest
+    """
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    try:
+        time.sleep(seconds)
+        snapshot = tracemalloc.take_snapshot()
+    finally:
+        if started:
+            tracemalloc.stop()
+    snapshot = snapshot.filter_traces(
+        (tracemalloc.Filter(False, tracemalloc.__file__),)
+    )
+    stacks = Counter()
+    for stat in snapshot.statistics("traceback")[:top]:
+        # tracebacks are ordered from the oldest frame, like folded stacks
+        frames = [f"{os.path.basename(f.filename)}:{f.lineno}" for f in stat.traceback]
+        stacks[";".join(frames)] += stat.size
+    return stacks
+
+
+def folded(stacks):
+    """Format stacks in the folded format read by flamegraph.pl and speedscope"""
+    return "".join(f"{stack} {weight}\n" for stack, weight in stacks.most_common())
+
+
+class ProfilingHandler(BaseHTTPRequestHandler):
+    """
+    GET /profile/wall?seconds=N    wall-clock stack samples of every thread
+    GET /profile/cpu?seconds=N     stack samples weighted by thread cpu time
+    GET /profile/memory?seconds=N&top=M
+                                   largest allocations made during the capture
+
+    Every profile is returned as folded stacks, one capture at a time.
+    """
+
+    lock = threading.Lock()
+
+    def _send(self, status, body):
+        body = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        try:
+            seconds = float(query.get("seconds", ["10"])[0])
+            top = int(query.get("top", ["50"])[0])
+        except ValueError:
+            self._send(400, "seconds and top must be numbers\n")
+            return
+        if not 0 < seconds <= MAX_PROFILE_SECONDS:
+            self._send(400, f"seconds must be in ]0, {MAX_PROFILE_SECONDS}]\n")
+            return
+
+        if url.path == "/profile/wall":
+            capture = partial(sample_stacks, seconds)
+        elif url.path == "/profile/cpu":
+            if not hasattr(time, "pthread_getcpuclockid"):
+                self._send(501, "no per thread cpu clock on this platform\n")
+                return
+            capture = partial(sample_stacks, seconds, cpu=True)
+        elif url.path == "/profile/memory":
+            capture = partial(allocation_stacks, seconds, top)
+        else:
+            self._send(404, "not found\n")
+            return
+
+        if not self.lock.acquire(blocking=False):
+            self._send(409, "a profile is already being captured\n")
+            return
+        try:
+            stacks = capture()
+        finally:
+            self.lock.release()
+        self._send(200, folded(stacks))
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_profiling_server(port, addr="127.0.0.1"):
+    """Serve the profiling endpoint on a daemon thread"""
+    server = ThreadingHTTPServer((addr, port), ProfilingHandler)
+    thread = threading.Thread(
+        target=server.serve_forever, name="profiling", daemon=True
+    )
+    thread.start()
+    return server
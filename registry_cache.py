@@ -0,0 +1,168 @@
+"""On-disk cache of the chain registries"""
+
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+
+from metrics_enum import MetricsUrlStatus
+from telemetry import call_context, timed_call
+
+
+class RegistryCache:
+    """
+    Chain registry documents persisted on disk.
+
+    A registry is served from its cached copy right away, so a slow or
+    down registry does not prevent the exporter from starting, and is
+    revalidated in the background once older than the ttl, with ETag and
+    If-Modified-Since so an unchanged registry is not downloaded again.
+
+    Registry documents are not kept in memory, they are handed to the
+    on_update callback of the registry every time a version is loaded.
+    """
+
+    def __init__(self, cache_dir, ttl, rpc_call_status_counter, logging, timeout=30):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.rpc_call_status_counter = rpc_call_status_counter
+        self.logging = logging
+        self.timeout = timeout
+
+        self._entries = {}
+        self._callbacks = {}
+        self._session = requests.Session()
+        self._stop = threading.Event()
+        self._thread = None
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.cache_dir, f"{name}.json")
+
+    def _meta_path(self, name):
+        return os.path.join(self.cache_dir, f"{name}.meta.json")
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def register(self, name, url, on_update):
+        """Load a registry from disk, downloading it if it was never cached
+
+        Args:
+          name: registry name, used for the cache file names
+          url: registry url
+          on_update: callable(data) run with every loaded registry version
+        """
+        entry = {
+            "url": url,
+            "etag": None,
+            "last_modified": None,
+            "fetched_at": 0,
+            "cached": False,
+        }
+        self._entries[name] = entry
+        self._callbacks[name] = on_update
+
+        try:
+            if os.path.exists(self._meta_path(name)):
+                with open(self._meta_path(name), "r") as f:
+                    meta = json.load(f)
+                if meta.get("url") == url:
+                    with open(self._path(name), "r") as f:
+                        on_update(json.load(f))
+                    entry.update(meta, cached=True)
+        except Exception as err:
+            self.logging.error(f"Cannot read cached registry {name}: {err}")
+
+        if not entry["cached"]:
+            try:
+                self.refresh(name)
+            except Exception as err:
+                # the background refresh keeps retrying
+                self.logging.error(f"Cannot download registry {name}: {err}")
+
+    def refresh(self, name):
+        """Revalidate a registry against its url
+
+        Returns:
+          True if the registry changed
+        """
+        entry = self._entries[name]
+        parsed_url = urlparse(entry["url"])
+        server = f"{parsed_url.scheme}://{parsed_url.netloc}"
+
+        headers = {}
+        if entry["cached"]:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+        try:
+            with call_context(method="registry"), timed_call(server):
+                r = self._session.get(
+                    entry["url"], headers=headers, timeout=self.timeout
+                )
+            r.raise_for_status()
+            data = None if r.status_code == 304 else r.json()
+        except Exception as err:
+            self.rpc_call_status_counter.labels(
+                url=server, status=MetricsUrlStatus.FAILED.value
+            ).inc()
+            raise err
+        self.rpc_call_status_counter.labels(
+            url=server, status=MetricsUrlStatus.SUCCESS.value
+        ).inc()
+
+        changed = data is not None
+        if changed:
+            self._callbacks[name](data)
+            self._write(self._path(name), data)
+            entry.update(
+                etag=r.headers.get("ETag"),
+                last_modified=r.headers.get("Last-Modified"),
+                cached=True,
+            )
+        entry["fetched_at"] = time.time()
+        self._write(
+            self._meta_path(name),
+            {key: value for key, value in entry.items() if key != "cached"},
+        )
+        self.logging.info(f"Registry {name} {'updated' if changed else 'not modified'}")
+        return changed
+
+    def _write(self, path, data):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def refresh_stale(self):
+        """Refresh every registry older than the ttl"""
+        for name, entry in list(self._entries.items()):
+            if time.time() - entry["fetched_at"] < self.ttl:
+                continue
+            try:
+                self.refresh(name)
+            except Exception as err:
+                self.logging.error(f"Cannot refresh registry {name}: {err}")
+
+    def _refresh_loop(self):
+        # check often enough to retry failed refreshes well before the ttl
+        interval = min(self.ttl, 300)
+        while True:
+            self.refresh_stale()
+            if self._stop.wait(interval):
+                break
+
+    def start(self):
+        """Start the background refresh thread"""
+        self._thread = threading.Thread(
+            target=self._refresh_loop, name="registry-refresh", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,75 @@
+"""Compact index of the chain registries"""
+
+
+class ChainRecord:
+    """The few registry fields the exporter needs about a chain"""
+
+    __slots__ = ("name", "denom", "decimals", "symbol", "chain_id")
+
+    def __init__(self, name, denom, decimals, symbol, chain_id):
+        self.name = name
+        self.denom = denom
+        self.decimals = decimals
+        self.symbol = symbol
+        self.chain_id = chain_id
+
+    def __getitem__(self, key):
+        # keep the chain_registry["denom"] style of the raw registry dicts
+        return getattr(self, key)
+
+
+def index_cosmos_registry(data):
+    """Return a dict of chain name to ChainRecord from a cosmos directory"""
+    index = {}
+    for chain in data.get("chains", []):
+        if "denom" not in chain or "decimals" not in chain:
+            continue
+        index[chain["name"]] = ChainRecord(
+            name=chain["name"],
+            denom=chain["denom"],
+            decimals=chain["decimals"],
+            symbol=chain.get("symbol", chain["denom"]),
+            chain_id=chain.get("chain_id"),
+        )
+    return index
+
+
+def index_evm_chains(data):
+    """Return a dict of chain id to ChainRecord from chainid.network"""
+    index = {}
+    for chain in data:
+        currency = chain.get("nativeCurrency", {})
+        index[chain["chainId"]] = ChainRecord(
+            name=chain.get("name"),
+            denom=None,
+            decimals=currency.get("decimals", 18),
+            symbol=currency.get("symbol", "Unknown"),
+            chain_id=chain["chainId"],
+        )
+    return index
+
+
+class RegistryIndex:
+    """
+    O(1) lookup of chains by key across several registries, built once per
+    registry version instead of scanning the raw registry documents.
+    """
+
+    def __init__(self):
+        self._indexes = {}
+
+    def update(self, registry, index):
+        """Replace the index of a registry"""
+        self._indexes[registry] = index
+
+    def get(self, key, *registries):
+        """Return the record of a key from the first registry that has it"""
+        for registry in registries:
+            record = self._indexes.get(registry, {}).get(key)
+            if record is not None:
+                return record
+        return None
+
+    def registry(self, registry):
+        """Return the whole index of a registry"""
+        return self._indexes.get(registry, {})
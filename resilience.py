@@ -0,0 +1,177 @@
+"""Circuit breakers of the api/rpc endpoints"""
+
+import asyncio
+import threading
+import time
+from enum import Enum
+from functools import partial
+
+import httpx
+import websocket
+from aiohttp import ClientError
+
+from utils import HttpCallError
+
+# errors reaching an endpoint, whatever was asked, requests ones being OSError
+TRANSPORT_ERRORS = (
+    OSError,
+    TimeoutError,
+    asyncio.TimeoutError,
+    ClientError,
+    httpx.TransportError,
+    websocket.WebSocketException,
+)
+
+
+class CircuitState(Enum):
+    CLOSED = 0
+    HALF_OPEN = 1
+    OPEN = 2
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an endpoint whose circuit is open"""
+
+
+def _failed_status(status):
+    return status == 429 or status >= 500
+
+
+def is_endpoint_failure(error):
+    """Tell if a call error counts against the endpoint
+
+    Transport errors, timeouts and 5xx/429 responses do, looking through
+    the errors they were wrapped in. Errors a healthy endpoint answers
+    with, like a 400 for a mistyped address or a contract revert, do not.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, CircuitOpenError):
+            return True
+        if isinstance(error, HttpCallError):
+            # no status when the endpoint could not be reached
+            return error.status is None or _failed_status(error.status)
+        status = getattr(getattr(error, "response", None), "status_code", None)
+        if status is None and isinstance(getattr(error, "status", None), int):
+            status = error.status
+        if status is not None:
+            return _failed_status(status)
+        if isinstance(error, TRANSPORT_ERRORS):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+class CircuitBreaker:
+    """
+    Stop calling an endpoint after failure_threshold consecutive failures.
+
+    Once open, calls fail fast until reset_timeout has elapsed, then a
+    single probe call is let through (half-open): its success closes the
+    circuit, its failure opens it again for another reset_timeout.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, on_state_change=None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.on_state_change = on_state_change
+
+        self.state = CircuitState.CLOSED
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = 0
+        self._probing = False
+
+    def _set_state(self, state):
+        if state != self.state:
+            self.state = state
+            if self.on_state_change is not None:
+                self.on_state_change(state)
+
+    def allow(self):
+        """Tell if a call can go through, taking the probe slot if half-open"""
+        with self._lock:
+            if self.state == CircuitState.CLOSED:
+                return True
+            if self.state == CircuitState.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._set_state(CircuitState.HALF_OPEN)
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def release(self):
+        """Give back the probe slot of a call cancelled before its outcome"""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            self._set_state(CircuitState.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if (
+                self.state == CircuitState.HALF_OPEN
+                or self._failures >= self.failure_threshold
+            ):
+                self._probing = False
+                self._opened_at = time.monotonic()
+                self._set_state(CircuitState.OPEN)
+
+
+class CircuitBreakers:
+    """One CircuitBreaker per endpoint host, created on first use"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, on_state_change=None):
+        """
+        Args:
+          on_state_change: callable(host, state) run when a circuit changes state
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.on_state_change = on_state_change
+
+        self._lock = threading.Lock()
+        self._breakers = {}
+
+    def get(self, host):
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                on_state_change = None
+                if self.on_state_change is not None:
+                    on_state_change = partial(self.on_state_change, host)
+                breaker = CircuitBreaker(
+                    self.failure_threshold, self.reset_timeout, on_state_change
+                )
+                self._breakers[host] = breaker
+                if on_state_change is not None:
+                    on_state_change(breaker.state)
+            return breaker
+
+    def call(self, host, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) through the circuit of a host
+
+        Only the errors of is_endpoint_failure count as failures, the host
+        answered the other ones.
+        """
+        breaker = self.get(host)
+        if not breaker.allow():
+            raise CircuitOpenError(f"circuit open for {host}")
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            if is_endpoint_failure(e):
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            raise
+        breaker.record_success()
+        return result
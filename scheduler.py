@@ -0,0 +1,77 @@
+"""Per network polling schedulers"""
+
+import random
+import threading
+import time
+
+# longest random delay of the first tick, in seconds
+MAX_START_PHASE = 5
+
+
+class NetworkScheduler:
+    """
+    Run the fetch job of a network on its own thread at a fixed rate.
+
+    Ticks are laid on a fixed clock (start + n * interval) so the period
+    does not drift by the duration of the fetch. The first tick runs right
+    away, after a short random phase, and every later tick is delayed by a
+    small random jitter, so the networks do not hit every endpoint at the
+    same time.
+
+    A fetch running past the next tick does not stretch the period, the
+    missed ticks are skipped and reported to on_overrun.
+    """
+
+    def __init__(self, name, interval, job, on_overrun, logging, jitter=0.1):
+        """
+        Args:
+          name: network name, used for the thread name and logs
+          interval: polling interval in seconds
+          job: callable run at every tick
+          on_overrun: callable(missed) run when ticks are skipped
+          jitter: maximum random delay of a tick, as a fraction of the interval
+        """
+        self.name = name
+        self.interval = interval
+        self.job = job
+        self.on_overrun = on_overrun
+        self.logging = logging
+        self.jitter = jitter
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _loop(self):
+        next_run = time.monotonic()
+        delay = next_run + random.uniform(
+            0, min(self.jitter * self.interval, MAX_START_PHASE)
+        )
+        while not self._stop.wait(max(0, delay - time.monotonic())):
+            try:
+                self.job()
+            except Exception as e:
+                self.logging.error(f"Fetching {self.name} failed: {e}")
+
+            next_run += self.interval
+            now = time.monotonic()
+            if now > next_run:
+                missed = int((now - next_run) // self.interval) + 1
+                next_run += missed * self.interval
+                self.logging.warning(
+                    f"Fetching {self.name} overran its {self.interval}s interval, "
+                    f"skipping {missed} run(s)"
+                )
+                self.on_overrun(missed)
+            delay = next_run + random.uniform(0, self.jitter * self.interval)
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._loop, name=f"scheduler-{self.name}", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
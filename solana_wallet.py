@@ -1,10 +1,102 @@
-import base64
-import struct
+import threading
 
 from metrics_enum import MetricsUrlStatus
 from solana.rpc.api import Client
-from solana.rpc.types import TokenAccountOpts
+from solana.rpc.types import DataSliceOpts, TokenAccountOpts
 from solders.pubkey import Pubkey
+from telemetry import timed_call
+from utils import request_timeout
+
+# getMultipleAccounts accepts up to 100 keys per request
+MULTIPLE_ACCOUNTS_BATCH_SIZE = 100
+LAMPORTS_PER_SOL = 1_000_000_000
+TOKEN_PROGRAM_ID = Pubkey.from_string("TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA")
+TOKEN_2022_PROGRAM_ID = Pubkey.from_string(
+    "TokenzQdBNbLqP5VEhdkAS6EPFLC1PHnBqCXEpPxuEb"
+)
+
+# one pooled client per rpc url
+_clients: dict = {}
+_clients_lock = threading.Lock()
+
+# decimals of a mint never change, keyed by (rpc url, mint)
+_mint_decimals: dict = {}
+
+
+def get_solana_client(rpc_url):
+    """Return the shared client of an rpc url, creating it on first use"""
+    with _clients_lock:
+        client = _clients.get(rpc_url)
+        if client is None:
+            client = Client(rpc_url, timeout=request_timeout())
+            _clients[rpc_url] = client
+        return client
+
+
+def get_solana_slot(rpc_url, rpc_call_status_counter):
+    """Return the current slot of an rpc endpoint"""
+    try:
+        with timed_call(rpc_url):
+            slot = get_solana_client(rpc_url).get_slot().value
+    except Exception as err:
+        rpc_call_status_counter.labels(
+            url=rpc_url, status=MetricsUrlStatus.FAILED.value
+        ).inc()
+        raise err
+    rpc_call_status_counter.labels(
+        url=rpc_url, status=MetricsUrlStatus.SUCCESS.value
+    ).inc()
+    return slot
+
+
+def get_solana_balances(
+    rpc_url, addresses, rpc_call_status_counter, batch_size=MULTIPLE_ACCOUNTS_BATCH_SIZE
+):
+    """
+    Get SOL balances for many wallet addresses with getMultipleAccounts.
+
+    Args:
+        rpc_url: Solana RPC endpoint URL
+        addresses: list of Solana wallet addresses (base58 encoded)
+        rpc_call_status_counter: Prometheus counter for RPC call status
+        batch_size: maximum number of addresses in a single request
+
+    Returns:
+        dict: address to balance in SOL, invalid addresses are missing
+    """
+    client = get_solana_client(rpc_url)
+    pubkeys = {}
+    for address in dict.fromkeys(addresses):
+        try:
+            pubkeys[address] = Pubkey.from_string(address)
+        except ValueError:
+            continue
+
+    balances = {}
+    chunk_addresses = list(pubkeys)
+    for start in range(0, len(chunk_addresses), batch_size):
+        chunk = chunk_addresses[start : start + batch_size]
+        try:
+            # only lamports are needed, skip the account data
+            with timed_call(rpc_url):
+                response = client.get_multiple_accounts(
+                    [pubkeys[address] for address in chunk],
+                    data_slice=DataSliceOpts(offset=0, length=0),
+                )
+        except Exception as err:
+            rpc_call_status_counter.labels(
+                url=rpc_url, status=MetricsUrlStatus.FAILED.value
+            ).inc()
+            raise err
+        rpc_call_status_counter.labels(
+            url=rpc_url, status=MetricsUrlStatus.SUCCESS.value
+        ).inc()
+
+        for address, account in zip(chunk, response.value):
+            # accounts that were never funded do not exist
+            lamports = account.lamports if account is not None else 0
+            balances[address] = lamports / LAMPORTS_PER_SOL
+    return balances
 
 
 def get_solana_balance(rpc_url, address: str, rpc_call_status_counter):
@@ -20,13 +112,14 @@ def get_solana_balance(rpc_url, address: str, rpc_call_status_counter):
         dict: Contains balance in SOL and symbol
     """
     try:
-        client = Client(rpc_url)
+        client = get_solana_client(rpc_url)
         pubkey = Pubkey.from_string(address)
-        response = client.get_balance(pubkey)
+        with timed_call(rpc_url):
+            response = client.get_balance(pubkey)
 
         if response.value is not None:
             # Convert lamports to SOL (1 SOL = 1,000,000,000 lamports)
-            balance_sol = response.value / 1_000_000_000
+            balance_sol = response.value / LAMPORTS_PER_SOL
 
             rpc_call_status_counter.labels(
                 url=rpc_url, status=MetricsUrlStatus.SUCCESS.value
@@ -46,49 +139,84 @@ def get_solana_balance(rpc_url, address: str, rpc_call_status_counter):
         raise err
 
 
-def get_solana_token_balance(
-    rpc_url, address: str, token_mint: str, rpc_call_status_counter
+def get_solana_token_balances(
+    rpc_url, address: str, rpc_call_status_counter, token_mint: str = None
 ):
     """
-    Get SPL token balance for a Solana wallet address.
+    Get every SPL token balance of a Solana wallet address with one
+    jsonParsed getTokenAccountsByOwner call per token program, the legacy
+    Token program and Token-2022.
 
     Args:
         rpc_url: Solana RPC endpoint URL
         address: Solana wallet address (base58 encoded)
-        token_mint: SPL token mint address
         rpc_call_status_counter: Prometheus counter for RPC call status
+        token_mint: only query the accounts of this mint, all mints if None
 
     Returns:
-        dict: Contains token balance and metadata
+        dict: mint address to token balance, raw balance and decimals,
+        summed over all the token accounts of the mint
     """
+    if token_mint is None:
+        opts = [
+            TokenAccountOpts(program_id=program_id)
+            for program_id in (TOKEN_PROGRAM_ID, TOKEN_2022_PROGRAM_ID)
+        ]
+    else:
+        opts = [TokenAccountOpts(mint=Pubkey.from_string(token_mint))]
     try:
-        client = Client(rpc_url)
-
-        # Get token accounts by owner
-        opts = TokenAccountOpts(mint=Pubkey.from_string(token_mint))
-        response = client.get_token_accounts_by_owner(Pubkey.from_string(address), opts)
-
-        if response.value:
-            # Parse the token account data
-            for account in response.value:
-                account_data = base64.b64decode(account.account.data[0])
-                # SPL token account layout: amount is at bytes 64-72 (u64)
-                amount = struct.unpack("<Q", account_data[64:72])[0]
-
-                rpc_call_status_counter.labels(
-                    url=rpc_url, status=MetricsUrlStatus.SUCCESS.value
-                ).inc()
-
-                return {"balance": amount, "raw_balance": amount}
-
-        rpc_call_status_counter.labels(
-            url=rpc_url, status=MetricsUrlStatus.SUCCESS.value
-        ).inc()
-
-        return {"balance": 0, "raw_balance": 0}
-
+        client = get_solana_client(rpc_url)
+        accounts = []
+        for opt in opts:
+            with timed_call(rpc_url):
+                response = client.get_token_accounts_by_owner_json_parsed(
+                    Pubkey.from_string(address), opt
+                )
+            accounts.extend(response.value)
     except Exception as err:
         rpc_call_status_counter.labels(
             url=rpc_url, status=MetricsUrlStatus.FAILED.value
         ).inc()
         raise err
+    rpc_call_status_counter.labels(
+        url=rpc_url, status=MetricsUrlStatus.SUCCESS.value
+    ).inc()
+
+    raw_balances: dict = {}
+    for account in accounts:
+        info = account.account.data.parsed["info"]
+        mint = info["mint"]
+        token_amount = info["tokenAmount"]
+        _mint_decimals.setdefault((rpc_url, mint), token_amount["decimals"])
+        raw_balances[mint] = raw_balances.get(mint, 0) + int(token_amount["amount"])
+
+    balances = {}
+    for mint, raw_balance in raw_balances.items():
+        decimals = _mint_decimals[(rpc_url, mint)]
+        balances[mint] = {
+            "balance": raw_balance / 10**decimals,
+            "raw_balance": raw_balance,
+            "decimals": decimals,
+        }
+    return balances
+
+
+def get_solana_token_balance(
+    rpc_url, address: str, token_mint: str, rpc_call_status_counter
+):
+    """
+    Get SPL token balance for a Solana wallet address.
+
+    Args:
+        rpc_url: Solana RPC endpoint URL
+        address: Solana wallet address (base58 encoded)
+        token_mint: SPL token mint address
+        rpc_call_status_counter: Prometheus counter for RPC call status
+
+    Returns:
+        dict: Contains token balance and metadata
+    """
+    balances = get_solana_token_balances(
+        rpc_url, address, rpc_call_status_counter, token_mint=token_mint
+    )
+    return balances.get(token_mint, {"balance": 0, "raw_balance": 0})
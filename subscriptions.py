@@ -0,0 +1,294 @@
+"""Websocket subscriptions to chain events"""
+
+import asyncio
+import json
+import threading
+from abc import ABC, abstractmethod
+
+import websockets
+
+# keccak("Transfer(address,address,uint256)")
+TRANSFER_TOPIC = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+
+
+def _address_topic(address):
+    return "0x" + address[2:].lower().rjust(64, "0")
+
+
+def _topic_address(topic):
+    return "0x" + topic[-40:].lower()
+
+
+class WebsocketSubscription(ABC):
+    """
+    Websocket kept open on its own thread and event loop, reconnected
+    after reconnect_delay when it drops. Subclasses subscribe and handle
+    the notifications in _listen.
+
+    Notifications only carry changes, so on_resync is called once
+    subscribed to take a snapshot, again after every reconnection, and
+    every resync_interval seconds if set.
+    """
+
+    def __init__(
+        self, name, ws_url, on_resync, logging, reconnect_delay=5, resync_interval=None
+    ):
+        self.name = name
+        self.ws_url = ws_url
+        self.on_resync = on_resync
+        self.logging = logging
+        self.reconnect_delay = reconnect_delay
+        self.resync_interval = resync_interval
+
+        self._loop = None
+        self._task = None
+        self._thread = None
+
+    def _callback(self, fn, *args):
+        asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    def _subscribed(self):
+        """Resync once subscribed, events may have been missed meanwhile"""
+        self._callback(self.on_resync)
+
+    @abstractmethod
+    async def _listen(self):
+        """Connect, subscribe and handle the notifications until disconnected"""
+
+    async def _resync_periodically(self):
+        while True:
+            await asyncio.sleep(self.resync_interval)
+            self._callback(self.on_resync)
+
+    async def _run(self):
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.current_task()
+        resync = None
+        if self.resync_interval:
+            resync = asyncio.ensure_future(self._resync_periodically())
+        try:
+            while True:
+                try:
+                    await self._listen()
+                except Exception as e:
+                    self.logging.error(f"{self.name} subscription failed: {e}")
+                await asyncio.sleep(self.reconnect_delay)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            if resync is not None:
+                resync.cancel()
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=asyncio.run,
+            args=(self._run(),),
+            name=f"subscription-{self.name}",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._task.cancel)
+
+
+class EvmSubscription(WebsocketSubscription):
+    """
+    Websocket to an evm node subscribed to newHeads and to the ERC-20
+    Transfer logs from or to the wallets.
+
+    Every new head is handed to on_head with the block numbers since the
+    previous head and the wallets whose token balance changed meanwhile.
+    on_resync is also called after a gap of more than max_block_gap
+    blocks. Callbacks run on a worker thread, off the event loop.
+    """
+
+    def __init__(
+        self,
+        name,
+        ws_url,
+        addresses,
+        token_addresses,
+        on_head,
+        on_resync,
+        logging,
+        max_block_gap=32,
+        reconnect_delay=5,
+    ):
+        """
+        Args:
+          name: network name, used for the thread name and logs
+          ws_url: websocket endpoint of the node
+          addresses: wallet addresses
+          token_addresses: ERC-20 contracts whose Transfer logs are followed
+          on_head: callable(block_numbers, token_touched) run at every head
+          on_resync: callable() run when events may have been missed
+        """
+        super().__init__(name, ws_url, on_resync, logging, reconnect_delay)
+        self.addresses = {address.lower() for address in addresses}
+        self.token_addresses = sorted(token_addresses)
+        self.on_head = on_head
+        self.max_block_gap = max_block_gap
+
+        self._head = None
+
+    async def _subscribe(self, ws, request_id, params):
+        await ws.send(
+            json.dumps(
+                {
+                    "jsonrpc": "2.0",
+                    "id": request_id,
+                    "method": "eth_subscribe",
+                    "params": params,
+                }
+            )
+        )
+        while True:
+            message = json.loads(await ws.recv())
+            if message.get("id") != request_id:
+                # notifications missed here are covered by the resync
+                continue
+            if "error" in message:
+                raise Exception(f"eth_subscribe failed: {message['error']}")
+            return message["result"]
+
+    def _new_head(self, number, token_touched):
+        if self._head is None or number <= self._head:
+            # first head or reorg, only the new head is read
+            block_numbers = [number]
+        elif number - self._head > self.max_block_gap:
+            self._head = number
+            self._callback(self.on_resync)
+            return
+        else:
+            block_numbers = list(range(self._head + 1, number + 1))
+        self._head = number
+        self._callback(self.on_head, block_numbers, token_touched)
+
+    async def _listen(self):
+        async with websockets.connect(self.ws_url, max_size=None) as ws:
+            subscriptions = {}
+            request_id = 0
+            if self.token_addresses:
+                wallet_topics = [_address_topic(a) for a in sorted(self.addresses)]
+                # transfers from and to the wallets
+                for topics in (
+                    [TRANSFER_TOPIC, wallet_topics],
+                    [TRANSFER_TOPIC, None, wallet_topics],
+                ):
+                    request_id += 1
+                    params = [
+                        "logs",
+                        {"address": self.token_addresses, "topics": topics},
+                    ]
+                    subscription = await self._subscribe(ws, request_id, params)
+                    subscriptions[subscription] = "logs"
+            request_id += 1
+            subscription = await self._subscribe(ws, request_id, ["newHeads"])
+            subscriptions[subscription] = "newHeads"
+            self.logging.info(f"Subscribed to {self.name} heads and transfers")
+            self._subscribed()
+
+            token_touched = set()
+            async for message in ws:
+                message = json.loads(message)
+                params = message.get("params")
+                if message.get("method") != "eth_subscription" or not params:
+                    continue
+                kind = subscriptions.get(params["subscription"])
+                result = params["result"]
+                if kind == "logs":
+                    for topic in result["topics"][1:3]:
+                        address = _topic_address(topic)
+                        if address in self.addresses:
+                            token_touched.add(address)
+                elif kind == "newHeads":
+                    self._new_head(int(result["number"], 16), token_touched)
+                    token_touched = set()
+
+
+class SolanaAccountSubscription(WebsocketSubscription):
+    """
+    Websocket to a solana rpc multiplexing an accountSubscribe for every
+    address, each notification handing the new lamports of an account to
+    on_balance.
+
+    accountSubscribe does not send the current state, the snapshot is
+    taken once every address is subscribed. Notifications may still be
+    missed, the balances are read again every resync_interval seconds.
+    """
+
+    def __init__(
+        self,
+        name,
+        ws_url,
+        addresses,
+        on_balance,
+        on_resync,
+        logging,
+        commitment="confirmed",
+        reconnect_delay=5,
+        resync_interval=None,
+    ):
+        """
+        Args:
+          name: name used for the thread name and logs
+          ws_url: websocket endpoint of the rpc
+          addresses: account addresses
+          on_balance: callable(address, lamports) run at every notification
+          on_resync: callable() run when the balances must be read again
+          resync_interval: seconds between 2 reads of every balance
+        """
+        super().__init__(
+            name, ws_url, on_resync, logging, reconnect_delay, resync_interval
+        )
+        self.addresses = sorted(set(addresses))
+        self.on_balance = on_balance
+        self.commitment = commitment
+
+    async def _listen(self):
+        async with websockets.connect(self.ws_url, max_size=None) as ws:
+            # requests are pipelined, responses are matched by id
+            for request_id, address in enumerate(self.addresses):
+                await ws.send(
+                    json.dumps(
+                        {
+                            "jsonrpc": "2.0",
+                            "id": request_id,
+                            "method": "accountSubscribe",
+                            "params": [
+                                address,
+                                {"encoding": "base64", "commitment": self.commitment},
+                            ],
+                        }
+                    )
+                )
+
+            subscriptions = {}
+            pending = len(self.addresses)
+            if not pending:
+                self._subscribed()
+            async for message in ws:
+                message = json.loads(message)
+                if "id" in message:
+                    address = self.addresses[message["id"]]
+                    if "error" in message:
+                        self.logging.error(
+                            f"Cannot subscribe to {address}: {message['error']}"
+                        )
+                    else:
+                        subscriptions[message["result"]] = address
+                    pending -= 1
+                    if not pending:
+                        self.logging.info(
+                            f"Subscribed to {len(subscriptions)} {self.name} accounts"
+                        )
+                        self._subscribed()
+                elif message.get("method") == "accountNotification":
+                    params = message["params"]
+                    address = subscriptions.get(params["subscription"])
+                    if address is not None:
+                        lamports = params["result"]["value"]["lamports"]
+                        # a gauge update, run in order on the loop
+                        self.on_balance(address, lamports)
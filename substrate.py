@@ -1,27 +1,152 @@
+import threading
+
 from substrateinterface import SubstrateInterface
 from substrateinterface.exceptions import SubstrateRequestException
 
 from metrics_enum import MetricsUrlStatus
+from telemetry import timed_call
+from utils import request_timeout
 
+# long lived connections and chain properties, keyed by node url
+_connections: dict = {}
+_properties: dict = {}
+_connections_lock = threading.Lock()
 
-def get_substrate_account_balance(node_url, address, rpc_call_status_counter):
-    try:
-        substrate = SubstrateInterface(
+QUERY_MULTI_BATCH_SIZE = 500
+
+
+class SubstrateConnection:
+    """
+    A long lived SubstrateInterface with a lock, the websocket being shared
+    by every caller of the endpoint.
+
+    The runtime metadata is kept between calls and only reloaded by
+    substrate-interface when the runtime version of the chain changes.
+    """
+
+    def __init__(self, node_url):
+        self.node_url = node_url
+        self.lock = threading.Lock()
+        self.substrate = SubstrateInterface(
             url=node_url,
+            auto_reconnect=True,
+            ws_options={"timeout": request_timeout()},
         )
-        result = substrate.query(
-            module="System", storage_function="Account", params=[address]
-        )
-        balance_info = result.value["data"]["free"]
 
+    def close(self):
+        try:
+            self.substrate.close()
+        except Exception:
+            pass
+
+
+def get_substrate_connection(node_url):
+    """Return the shared connection of a node, opening it on first use"""
+    with _connections_lock:
+        connection = _connections.get(node_url)
+        if connection is None:
+            connection = SubstrateConnection(node_url)
+            _connections[node_url] = connection
+        return connection
+
+
+def reset_substrate_connection(node_url):
+    """Drop the connection of a node, the next call opens a new one"""
+    with _connections_lock:
+        connection = _connections.pop(node_url, None)
+    if connection is not None:
+        connection.close()
+
+
+def get_substrate_properties(node_url):
+    """Return the token decimals and symbol of a node, read once per node"""
+    properties = _properties.get(node_url)
+    if properties is None:
+        substrate = get_substrate_connection(node_url).substrate
+        properties = {
+            "decimals": substrate.properties.get("tokenDecimals", 0),
+            "symbol": substrate.properties.get("tokenSymbol", "UNIT"),
+        }
+        _properties[node_url] = properties
+    return properties
+
+
+def get_substrate_block_number(node_url, rpc_call_status_counter):
+    """Return the number of the best block of a node"""
+    try:
+        connection = get_substrate_connection(node_url)
+        with connection.lock, timed_call(node_url):
+            block_number = connection.substrate.get_block_number(None)
+    except Exception as e:
         rpc_call_status_counter.labels(
-            url=node_url, status=MetricsUrlStatus.SUCCESS.value
+            url=node_url, status=MetricsUrlStatus.FAILED.value
         ).inc()
-        decimals = substrate.properties.get("tokenDecimals", 0)
-        symbol = substrate.properties.get("tokenSymbol", "UNIT")
-        return {"balance": balance_info, "decimals": decimals, "symbol": symbol}
+        if not isinstance(e, SubstrateRequestException):
+            reset_substrate_connection(node_url)
+        raise e
+    rpc_call_status_counter.labels(
+        url=node_url, status=MetricsUrlStatus.SUCCESS.value
+    ).inc()
+    return block_number
+
+
+def get_substrate_balances(
+    node_url, addresses, rpc_call_status_counter, batch_size=QUERY_MULTI_BATCH_SIZE
+):
+    """Get the free balance of many accounts with a single query_multi
+
+    Args:
+      node_url: substrate websocket endpoint
+      addresses: list of ss58 addresses
+      rpc_call_status_counter: Prometheus counter for RPC call status
+      batch_size: maximum number of storage keys in a single query_multi
+    Returns:
+      A dict with decimals, symbol and balances, a dict of address to free balance
+    """
+    try:
+        connection = get_substrate_connection(node_url)
+        result = []
+        with connection.lock:
+            substrate = connection.substrate
+            for start in range(0, len(addresses), batch_size):
+                storage_keys = [
+                    substrate.create_storage_key("System", "Account", [address])
+                    for address in addresses[start : start + batch_size]
+                ]
+                with timed_call(node_url):
+                    result.extend(substrate.query_multi(storage_keys))
+        properties = get_substrate_properties(node_url)
     except SubstrateRequestException as e:
         rpc_call_status_counter.labels(
             url=node_url, status=MetricsUrlStatus.FAILED.value
         ).inc()
         raise e
+    except Exception as e:
+        # the websocket is likely broken, reconnect on the next call
+        rpc_call_status_counter.labels(
+            url=node_url, status=MetricsUrlStatus.FAILED.value
+        ).inc()
+        reset_substrate_connection(node_url)
+        raise e
+
+    rpc_call_status_counter.labels(
+        url=node_url, status=MetricsUrlStatus.SUCCESS.value
+    ).inc()
+    balances = {
+        storage_key.params[0]: value.value["data"]["free"]
+        for storage_key, value in result
+    }
+    return {
+        "balances": balances,
+        "decimals": properties["decimals"],
+        "symbol": properties["symbol"],
+    }
+
+
+def get_substrate_account_balance(node_url, address, rpc_call_status_counter):
+    info = get_substrate_balances(node_url, [address], rpc_call_status_counter)
+    return {
+        "balance": info["balances"][address],
+        "decimals": info["decimals"],
+        "symbol": info["symbol"],
+    }
@@ -0,0 +1,55 @@
+"""Timing of the api/rpc calls"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import Histogram
+
+RPC_CALL_DURATION = Histogram(
+    "rpc_call_duration_seconds",
+    "Duration of the api/rpc calls",
+    ["url", "method", "network_type"],
+)
+
+# what the calls of the current job are for, set by the exporter per job
+_method = ContextVar("rpc_method", default="other")
+_network_type = ContextVar("network_type", default="unknown")
+
+
+@contextmanager
+def call_context(method=None, network_type=None):
+    """Label the calls made in the block with a method and a network type"""
+    tokens = []
+    if method is not None:
+        tokens.append((_method, _method.set(method)))
+    if network_type is not None:
+        tokens.append((_network_type, _network_type.set(network_type)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+def call_method():
+    """Return the method the calls of the current job are labelled with"""
+    return _method.get()
+
+
+async def with_call_context(coro, method=None, network_type=None):
+    """Await a coroutine with its calls labelled like call_context"""
+    with call_context(method, network_type):
+        return await coro
+
+
+@contextmanager
+def timed_call(url):
+    """Record the duration of a call to url, failed or not"""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        RPC_CALL_DURATION.labels(
+            url=url, method=_method.get(), network_type=_network_type.get()
+        ).observe(time.monotonic() - start)
@@ -1,36 +1,66 @@
+import asyncio
 import json
 import logging
+import os
+import threading
 from urllib.parse import urlparse
 
+import aiohttp
 import requests
 import structlog
 import yaml
 from requests.exceptions import HTTPError
 
 from metrics_enum import MetricsUrlStatus
+from telemetry import timed_call
+from wallet_sources import WalletFileError, load_wallets_file
 
+# seconds a single api/rpc call may take, so a hung endpoint cannot block a fetch
+REQUEST_TIMEOUT = 10
+_request_timeout = REQUEST_TIMEOUT
 
-def http_json_call(url, params, rpc_call_status_counter):
+
+def set_request_timeout(seconds):
+    """Set the timeout of the api/rpc calls, for the clients created after it"""
+    global _request_timeout
+    _request_timeout = seconds
+
+
+def request_timeout():
+    """Return the timeout in seconds of a single api/rpc call"""
+    return _request_timeout
+
+
+class HttpCallError(Exception):
+    """Raised by the http json calls, with the HTTP status of the response if any"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+def http_json_call(url, params, rpc_call_status_counter, timeout=None):
     parsed_url = urlparse(url)
     server = f"{parsed_url.scheme}://{parsed_url.netloc}"
     try:
-        r = requests.get(url, params=params)
+        with timed_call(server):
+            r = requests.get(url, params=params, timeout=timeout or request_timeout())
         r.raise_for_status()
     except HTTPError as http_err:
         rpc_call_status_counter.labels(
             url=server, status=MetricsUrlStatus.FAILED.value
         ).inc()
         if r.content is not None:
-            raise Exception(
-                f"HTTP error occurred: {http_err}: {r.content}"
+            raise HttpCallError(
+                f"HTTP error occurred: {http_err}: {r.content}", r.status_code
             )  # Python 3.6
         else:
-            raise Exception(f"HTTP error occurred: {http_err}")
+            raise HttpCallError(f"HTTP error occurred: {http_err}", r.status_code)
     except Exception as err:
         rpc_call_status_counter.labels(
             url=server, status=MetricsUrlStatus.FAILED.value
         ).inc()
-        raise Exception(f"Other error occurred: {err}")  # Python 3.6
+        raise HttpCallError(f"Other error occurred: {err}")  # Python 3.6
     else:
         rpc_call_status_counter.labels(
             url=server, status=MetricsUrlStatus.SUCCESS.value
@@ -38,6 +68,86 @@ def http_json_call(url, params, rpc_call_status_counter):
         return json.loads(r.content)
 
 
+def client_timeout(timeout):
+    """Return an aiohttp timeout for the socket operations of a request
+
+    Not a total timeout, which would also count the wait for a connection of
+    the per host pool, so requests queued behind others would time out.
+    """
+    return aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout)
+
+
+async def async_http_json_call(
+    session, url, params, rpc_call_status_counter, timeout=None
+):
+    """Async counterpart of http_json_call using a pooled aiohttp session
+
+    Args:
+      session: aiohttp.ClientSession shared by all the calls
+      url: url to query
+      params: query string parameters
+      rpc_call_status_counter: Prometheus counter for RPC call status
+      timeout: per request timeout in seconds, the session one if None
+    Returns:
+      The decoded json response
+    """
+    parsed_url = urlparse(url)
+    server = f"{parsed_url.scheme}://{parsed_url.netloc}"
+    # a None timeout would turn off the one of the session
+    kwargs = {"timeout": client_timeout(timeout)} if timeout else {}
+    try:
+        with timed_call(server):
+            async with session.get(url, params=params, **kwargs) as r:
+                content = await r.read()
+        if r.status >= 400:
+            raise HTTPError(f"{r.status} {r.reason}: {content}")
+    except HTTPError as http_err:
+        rpc_call_status_counter.labels(
+            url=server, status=MetricsUrlStatus.FAILED.value
+        ).inc()
+        raise HttpCallError(f"HTTP error occurred: {http_err}", r.status)
+    except Exception as err:
+        rpc_call_status_counter.labels(
+            url=server, status=MetricsUrlStatus.FAILED.value
+        ).inc()
+        raise HttpCallError(f"Other error occurred: {err!r}")
+    else:
+        rpc_call_status_counter.labels(
+            url=server, status=MetricsUrlStatus.SUCCESS.value
+        ).inc()
+        return json.loads(content)
+
+
+class AsyncHttpClient:
+    """
+    Long lived aiohttp session running on its own event loop thread, so
+    connections are kept alive and pooled per host across fetch cycles.
+    """
+
+    def __init__(self, limit=100, limit_per_host=4, timeout=None):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="async-http", daemon=True
+        )
+        self._thread.start()
+        self.session = self.run(self._create_session(limit, limit_per_host, timeout))
+
+    async def _create_session(self, limit, limit_per_host, timeout):
+        connector = aiohttp.TCPConnector(limit=limit, limit_per_host=limit_per_host)
+        return aiohttp.ClientSession(
+            connector=connector, timeout=client_timeout(timeout or request_timeout())
+        )
+
+    def run(self, coro):
+        """Run a coroutine on the client loop and wait for its result"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def close(self):
+        self.run(self.session.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
 def read_config_file(file_path):
     """Read and Make sure field are present
 
@@ -65,7 +175,18 @@ def read_config_file(file_path):
             return f'Error: no "api" in {network["name"]}', False
         if "type" not in network:
             return f'Error: no "type" in {network["name"]}', False
+        if "polling_interval" in network and not (
+            isinstance(network["polling_interval"], (int, float))
+            and network["polling_interval"] > 0
+        ):
+            return (
+                f'Error: "polling_interval" of {network["name"]} should be a \
+positive number of seconds',
+                False,
+            )
 
+        if "wallets_file" in network:
+            network.setdefault("wallets", [])
         if "wallets" not in network or not isinstance(network["wallets"], list):
             return (
                 f'Error: Invalid configuration file:\
@@ -80,6 +201,22 @@ def read_config_file(file_path):
 either name and/or address are missing',
                     False,
                 )
+
+        if "wallets_file" in network:
+            # relative to the config file, resolved once for the reloads
+            network["wallets_file"] = os.path.join(
+                os.path.dirname(os.path.abspath(file_path)), network["wallets_file"]
+            )
+            try:
+                wallets = load_wallets_file(
+                    network["wallets_file"], network.get("wallets_format")
+                )
+            except (OSError, WalletFileError) as e:
+                return f'Error: Invalid {network["name"]} wallets file: {e}', False
+            # the cached list is kept as is so an unchanged file compares fast
+            if network["wallets"]:
+                wallets = network["wallets"] + wallets
+            network["wallets"] = wallets
     return "Configuration file validation successful", config_data
 
 
@@ -0,0 +1,143 @@
+"""Wallets read from external CSV or NDJSON files"""
+
+import csv
+import hashlib
+import json
+import os
+import sys
+import threading
+
+WALLET_FILE_FORMATS = {".csv": "csv", ".ndjson": "ndjson", ".jsonl": "ndjson"}
+
+# parsed wallet files, keyed by absolute path and format
+_files: dict = {}
+_files_lock = threading.Lock()
+
+
+class WalletFileError(Exception):
+    """Raised for an unreadable wallet file or an invalid row"""
+
+
+class WalletRecord:
+    """A wallet read from a file, lighter than a config dict"""
+
+    __slots__ = ("name", "address", "contract_address")
+
+    def __init__(self, name, address, contract_address=None):
+        self.name = name
+        self.address = address
+        self.contract_address = contract_address
+
+    # keep the wallet["address"] and "contract_address" in wallet style of
+    # the config dicts
+    def __getitem__(self, key):
+        value = getattr(self, key, None) if key in self.__slots__ else None
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return key in self.__slots__ and getattr(self, key) is not None
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def _fields(self):
+        return self.name, self.address, self.contract_address
+
+    def __eq__(self, other):
+        if not isinstance(other, WalletRecord):
+            return NotImplemented
+        return self._fields() == other._fields()
+
+    def __hash__(self):
+        return hash(self._fields())
+
+    def __repr__(self):
+        return f"WalletRecord{self._fields()!r}"
+
+
+def _digest(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def _csv_rows(f):
+    reader = csv.DictReader(f)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def _ndjson_rows(path, f):
+    for line_num, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            raise WalletFileError(f"{path}:{line_num}: invalid json: {e}")
+        if not isinstance(row, dict):
+            raise WalletFileError(f"{path}:{line_num}: a wallet should be an object")
+        yield line_num, row
+
+
+def _record(path, line_num, row):
+    name, address = row.get("name"), row.get("address")
+    if not name or not address:
+        raise WalletFileError(
+            f"{path}:{line_num}: either name and/or address are missing"
+        )
+    contract_address = row.get("contract_address") or None
+    if contract_address is not None:
+        # shared by every holder of the token
+        contract_address = sys.intern(str(contract_address))
+    return WalletRecord(str(name), str(address), contract_address)
+
+
+def read_wallets_file(path, file_format=None):
+    """Stream the wallets of a file, validating them row by row
+
+    Args:
+      path: CSV file with a header line, or NDJSON file with one object per
+        line, each wallet having a name, an address and an optional
+        contract_address
+      file_format: csv or ndjson, guessed from the file extension if None
+    Returns:
+      A list of WalletRecord
+    """
+    if file_format is None:
+        file_format = WALLET_FILE_FORMATS.get(os.path.splitext(path)[1].lower())
+    if file_format not in ("csv", "ndjson"):
+        raise WalletFileError(f"{path}: unknown wallet file format {file_format}")
+    with open(path, "r", newline="", encoding="utf-8-sig") as f:
+        if file_format == "csv":
+            rows = _csv_rows(f)
+        else:
+            rows = _ndjson_rows(path, f)
+        return [_record(path, line_num, row) for line_num, row in rows]
+
+
+def load_wallets_file(path, file_format=None):
+    """Return the wallets of a file, parsed again only when it changed
+
+    A file whose modification time and size, or else content hash, did not
+    change gives back the very same list, so the network it belongs to is
+    seen as unchanged by a config reload.
+    """
+    key = (os.path.abspath(path), file_format)
+    with _files_lock:
+        stat = os.stat(path)
+        stat = (stat.st_mtime_ns, stat.st_size)
+        cached = _files.get(key)
+        if cached is not None and cached[0] == stat:
+            return cached[2]
+        digest = _digest(path)
+        if cached is not None and cached[1] == digest:
+            wallets = cached[2]
+        else:
+            wallets = read_wallets_file(path, file_format)
+        _files[key] = (stat, digest, wallets)
+        return wallets